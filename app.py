@@ -1,71 +1,182 @@
-from flask import Flask, render_template, request, session, redirect, url_for
+from flask import Flask, Response, render_template, request, session, redirect, url_for
+import json
 import os
 import uuid
-import sqlite3
-from transformers import pipeline, logging as hf_logging
+import threading
+from contextlib import nullcontext
+import metrics
+from choice_cache import ChoiceCache, cache_key, seed_prompts
+from model_worker import ModelUnavailable, get_model_backend
+from session_store import NarrativeCache, ServerSideSessionInterface
+from speculative import Speculator
+from storage import DB_PATH, finish_story
 
-hf_logging.set_verbosity_error()  # Suppress unnecessary warnings
+# Sessions live in the story database and the cookie only carries their id,
+# so the per-process secret key is never used to sign session data.
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 4096))
+NARRATIVE_CACHE_SIZE = int(os.environ.get("NARRATIVE_CACHE_SIZE", 1024))
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  
+app.session_interface = ServerSideSessionInterface(DB_PATH, SESSION_CACHE_SIZE)
+metrics.init_app(app)
+narratives = NarrativeCache(DB_PATH, NARRATIVE_CACHE_SIZE)
 
-# Load GPT-Neo model for generating choices
-MODEL_NAME = "gpt2"
-generator = pipeline("text-generation", model=MODEL_NAME)
-
-DB_PATH = "story_database.db"
-
-# Initialize database
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE,
-            narrative TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def save_narrative(user_id, narrative):
-    """Save or update the current story in the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("REPLACE INTO stories (user_id, narrative) VALUES (?, ?)", (user_id, narrative))
-    conn.commit()
-    conn.close()
-
-def get_narrative(user_id):
-    """Retrieve the stored narrative for the given user."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT narrative FROM stories WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def generate_choices(narrative):
+# GPT-2 runs in-process ("local"), in the model worker pool ("worker", see
+# model_worker.py), is replaced by the cheap trigram model over the story
+# texts ("template") or by a deterministic stand-in ("fake"). A list such as
+# "local,template" falls back along it within MODEL_LATENCY_BUDGET_MS.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "local")
+model = get_model_backend(MODEL_BACKEND)
+
+CHOICE_COUNT = 3
+CANDIDATES_PER_CALL = int(os.environ.get("CANDIDATES_PER_CALL", 6))
+MAX_GENERATION_CALLS = 2
+FALLBACK_CHOICES = ["Investigate the mystery", "Confront the challenge", "Search for clues"]
+
+# Render the story page straight away and stream the choices in over SSE.
+STREAM_CHOICES = os.environ.get("STREAM_CHOICES", "1") == "1"
+
+# Generated choices are cached by narrative so repeated story paths skip the model.
+CHOICE_CACHE_SIZE = int(os.environ.get("CHOICE_CACHE_SIZE", 1024))
+CHOICE_CACHE_TTL = int(os.environ.get("CHOICE_CACHE_TTL", 7 * 24 * 3600))
+choice_cache = ChoiceCache(DB_PATH, CHOICE_CACHE_SIZE, ttl=CHOICE_CACHE_TTL) if CHOICE_CACHE_SIZE > 0 else None
+
+# While the user reads, choices for each offered branch are generated in the
+# background so the next turn can skip the model. 0 workers disables it.
+PREGENERATE_WORKERS = int(os.environ.get("PREGENERATE_WORKERS", 1))
+PREGENERATE_QUEUE = int(os.environ.get("PREGENERATE_QUEUE", 32))
+
+def extract_choice(text):
+    """Turn a raw continuation into a choice, or None if it is too short to use."""
+    choice = text.strip().split(".")[0].strip()
+    return choice if len(choice) > 10 else None
+
+def choices_key(narrative):
+    """Key the narrative's choices by the model's generation parameters; None when there is no cache."""
+    if not choice_cache:
+        return None
+    try:
+        return cache_key(narrative, dict(model.params, choices=CHOICE_COUNT))
+    except ModelUnavailable:
+        return None
+
+def stored_choices(key, narrative, session_id=None, wait=False, background=False):
+    """Return choices already generated for the narrative, by pre-generation or from the cache, or None.
+
+    With `wait`, a branch that is still being pre-generated is waited for;
+    otherwise only a finished one is used. The branch is checked first,
+    since pre-generated choices are cached too and a branch left behind
+    would count as wasted. Where the choices came from is recorded unless
+    this is `background` generation.
+    """
+    choices = None
+    if speculator and session_id:
+        choices = (speculator.result if wait else speculator.ready)(session_id, narrative)
+        source = "pregenerated"
+    if not choices and key:
+        with metrics.span("choice_cache"):
+            choices = choice_cache.get(key)
+        source = "cache"
+    if choices and not background:
+        metrics.inc("story_choice_requests_total", source=source)
+        metrics.note(choice_source=source)
+    return choices or None
+
+def cached_choices(narrative, session_id=None):
+    """Return previously generated or already pre-generated choices for the narrative, or None."""
+    return stored_choices(choices_key(narrative), narrative, session_id)
+
+def pregenerate_next(session_id, narrative, choices):
+    """Start generating choices for each branch the user can pick next."""
+    if speculator and session_id:
+        speculator.schedule(session_id, [narrative + " " + choice for choice in choices])
+
+def iter_choices(narrative, session_id=None, stream=False, background=False):
+    """Yield 3 unique, logical story continuations as each one becomes available.
+
+    With `stream`, candidates are decoded and yielded while the rest of the
+    batch is still generating; otherwise each batch is generated in full.
+    Any model error falls back to FALLBACK_CHOICES, except in `background`
+    generation (pre-generation), which raises it instead and does not hold
+    off other pre-generation.
+    """
+    key = choices_key(narrative)
+    stored = stored_choices(key, narrative, session_id, wait=True, background=background)
+    if stored:
+        yield from stored
+        pregenerate_next(session_id, narrative, stored)
+        return
+
+    choices = []
+    calls = 0
+    degraded = False
+    try:
+        with speculator.foreground() if speculator and not background else nullcontext():
+            while len(choices) < CHOICE_COUNT and calls < MAX_GENERATION_CALLS:
+                if stream:
+                    candidates = metrics.timed_iter(model.stream(narrative, session_id, CANDIDATES_PER_CALL), "generate")
+                else:
+                    with metrics.span("generate"):
+                        candidates = model.sample(narrative, session_id, CANDIDATES_PER_CALL)
+                for text in candidates:
+                    choice = extract_choice(text)
+                    if choice and choice not in choices:
+                        choices.append(choice)
+                        yield choice
+                        if len(choices) == CHOICE_COUNT:
+                            break
+                degraded = degraded or model.was_degraded()
+                calls += 1
+    except Exception as e:
+        if background:
+            raise
+        print(f"Model failed, using fallback choices: {e!r}")
+
+    source = "fallback" if len(choices) < CHOICE_COUNT else "degraded" if degraded else "model"
+    if not background:
+        metrics.observe("story_generation_attempts", calls, buckets=tuple(range(MAX_GENERATION_CALLS + 1)))
+        metrics.inc("story_choice_requests_total", source=source)
+        metrics.note(choice_source=source, generation_attempts=calls)
+    if source == "fallback":
+        for choice in FALLBACK_CHOICES:
+            if len(choices) == CHOICE_COUNT:
+                break
+            if choice not in choices:
+                choices.append(choice)
+                yield choice
+    elif key and not degraded:
+        with metrics.span("choice_cache"):
+            choice_cache.put(key, choices)
+    pregenerate_next(session_id, narrative, choices)
+
+def generate_choices(narrative, session_id=None, background=False):
     """Generate 3 unique, logical story continuations."""
-    base_prompt = narrative + "\nWhat happens next?"
-    choices = set()
-    attempts = 0
-    while len(choices) < 3 and attempts < 10:
-        response = generator(
-            base_prompt, max_new_tokens=40, num_return_sequences=1, temperature=0.9, top_p=0.95,
-            pad_token_id=generator.tokenizer.eos_token_id
-        )
-        choice = response[0]["generated_text"].replace(base_prompt, "").strip().split(".")[0].strip()
-        if len(choice) > 10:
-            choices.add(choice)
-        attempts += 1
-
-    if len(choices) < 3:  # Fallback choices
-        choices.update(["Investigate the mystery", "Confront the challenge", "Search for clues"])
-    return list(choices)[:3]
+    return list(iter_choices(narrative, session_id, background=background))
+
+speculator = Speculator(lambda narrative: generate_choices(narrative, background=True),
+                        PREGENERATE_WORKERS, PREGENERATE_QUEUE) if PREGENERATE_WORKERS > 0 else None
+
+def warm_choice_cache():
+    """Precompute choices for the seed prompts (story templates and story_data.json)."""
+    for prompt in seed_prompts(DB_PATH):
+        generate_choices(prompt)
+
+if choice_cache and os.environ.get("WARM_CHOICE_CACHE") == "1":
+    threading.Thread(target=warm_choice_cache, name="choice-cache-warmer", daemon=True).start()
+
+def render_story(narrative, user_id):
+    """Render the story page; uncached choices are streamed in by the page when streaming is on."""
+    if STREAM_CHOICES:
+        choices = cached_choices(narrative, user_id)
+        if choices:
+            pregenerate_next(user_id, narrative, choices)
+    else:
+        choices = generate_choices(narrative, user_id)
+    stream_url = url_for("stream_choices") if choices is None else None
+    with metrics.span("render"):
+        return render_template("story.html", narrative=narrative, choices=choices or [],
+                               stream_url=stream_url, user_id=user_id)
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -79,13 +190,10 @@ def index():
         session["user_id"] = user_id
 
         # The narrative starts with the user's input
-        narrative = user_prompt
-        choices = generate_choices(narrative)
-
-        save_narrative(user_id, narrative)
-        session["narrative"] = narrative
+        with metrics.span("save_narrative"):
+            narrative = narratives.append(user_id, user_prompt)
         
-        return render_template("story.html", narrative=narrative, choices=choices, user_id=user_id)
+        return render_story(narrative, user_id)
     
     return render_template("index.html")
 
@@ -100,14 +208,31 @@ def continue_story():
     if not selected_choice:
         return "Error: No choice selected!", 400
     
-    previous_narrative = session.get("narrative", "")
-    new_narrative = previous_narrative + " " + selected_choice
-    new_choices = generate_choices(new_narrative)
-
-    save_narrative(user_id, new_narrative)
-    session["narrative"] = new_narrative
+    with metrics.span("save_narrative"):
+        new_narrative = narratives.append(user_id, " " + selected_choice)
+    if speculator:
+        speculator.choose(user_id, new_narrative)
     
-    return render_template("story.html", narrative=new_narrative, choices=new_choices, user_id=user_id)
+    return render_story(new_narrative, user_id)
+
+@app.route("/choices/stream")
+def stream_choices():
+    """Stream the choices for the current narrative as Server-Sent Events."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return "Error: No active story session!", 400
+    with metrics.span("load_narrative"):
+        narrative = narratives.get(user_id)
+    if not narrative:
+        return "Error: No active story session!", 400
+
+    def events():
+        for choice in iter_choices(narrative, user_id, stream=True):
+            yield f"event: choice\ndata: {json.dumps(choice)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/ending")
 def ending():
@@ -116,8 +241,28 @@ def ending():
     if not user_id:
         return redirect(url_for("index"))
     
-    narrative = get_narrative(user_id)
-    return render_template("ending.html", narrative=narrative)
+    with metrics.span("load_narrative"):
+        narrative = narratives.get(user_id)
+    finish_story(user_id)  # stories never shown their ending count as abandoned
+    with metrics.span("render"):
+        return render_template("ending.html", narrative=narrative)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Expose request, stage and cache metrics in the Prometheus text format."""
+    lines = [metrics.registry.render()]
+    lines.extend(metrics.gauge_lines("story_narrative_cache", narratives.stats()))
+    if choice_cache:
+        lines.extend(metrics.gauge_lines("story_choice_cache", choice_cache.stats()))
+    if speculator:
+        lines.extend(metrics.gauge_lines("story_pregeneration", speculator.stats()))
+    try:
+        workers = model.health()
+    except ModelUnavailable:
+        workers = []
+    for i, health in enumerate(workers):
+        lines.extend(metrics.gauge_lines("story_model", health, worker=i))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(debug=True)
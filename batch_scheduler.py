@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+class BatchScheduler:
+    """Collect prompts from concurrent requests and run them as one batched generate call.
+
+    `generate_batch(prompts, count)` must return one list of `count`
+    continuations per prompt. Pending prompts are gathered for up to
+    `window` seconds, or until `max_batch_size` are waiting, before the
+    batch is dispatched.
+    """
+
+    def __init__(self, generate_batch, window=0.02, max_batch_size=8):
+        self.generate_batch = generate_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._batches = 0
+        self._prompts = 0
+        self._max_batch = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt, count):
+        """Queue a prompt and return a Future for its list of continuations."""
+        future = Future()
+        with self._cond:
+            self._pending.append((prompt, count, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def generate(self, prompt, count):
+        """Blocking helper: queue a prompt and wait for its continuations."""
+        return self.submit(prompt, count).result()
+
+    def stats(self):
+        """Return queue depth, batch-size and wait-time counters."""
+        with self._cond:
+            return {
+                "queue_depth": len(self._pending),
+                "batches": self._batches,
+                "prompts": self._prompts,
+                "mean_batch_size": self._prompts / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch,
+                "mean_wait_ms": self._total_wait / self._prompts * 1000 if self._prompts else 0.0,
+                "max_wait_ms": self._max_wait * 1000,
+            }
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.perf_counter() + self.window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # Requests asking for a different number of sequences wait for the next batch.
+            count = self._pending[0][1]
+            batch = []
+            for item in list(self._pending):
+                if len(batch) == self.max_batch_size:
+                    break
+                if item[1] == count:
+                    batch.append(item)
+                    self._pending.remove(item)
+
+            now = time.perf_counter()
+            self._batches += 1
+            self._prompts += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+            for _, _, _, queued_at in batch:
+                self._total_wait += now - queued_at
+                self._max_wait = max(self._max_wait, now - queued_at)
+            return batch, count
+
+    def _run(self):
+        while True:
+            batch, count = self._next_batch()
+            try:
+                results = self.generate_batch([prompt for prompt, _, _, _ in batch], count)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,114 @@
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+# Repeated prompts would otherwise be served from the choice cache.
+app.choice_cache = None
+calls = {"count": 0}
+
+PROMPTS = [
+    "A young wizard finds an ancient book in the library.",
+    "A spaceship crashes in your backyard at midnight.",
+    "A coded letter arrives at the detective's desk.",
+]
+
+def legacy_generate_choices(narrative):
+    """The original serial loop: one pipeline call per attempt, up to 10 attempts."""
+    import generation
+    generator = generation.get_generator()
+    base_prompt = narrative + generation.PROMPT_SUFFIX
+    choices = set()
+    attempts = 0
+    while len(choices) < 3 and attempts < 10:
+        calls["count"] += 1
+        response = generator(
+            base_prompt, max_new_tokens=40, num_return_sequences=1, temperature=0.9, top_p=0.95,
+            pad_token_id=generator.tokenizer.eos_token_id
+        )
+        choice = response[0]["generated_text"].replace(base_prompt, "").strip().split(".")[0].strip()
+        if len(choice) > 10:
+            choices.add(choice)
+        attempts += 1
+    if len(choices) < 3:
+        choices.update(app.FALLBACK_CHOICES)
+    return list(choices)[:3]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run(generate, requests):
+    """Time `requests` calls of `generate` and count the model calls each one made."""
+    original_sample = app.model.sample
+
+    def counting_sample(*args, **kwargs):
+        calls["count"] += 1
+        return original_sample(*args, **kwargs)
+
+    app.model.sample = counting_sample
+    latencies, per_request = [], []
+    try:
+        for i in range(requests):
+            calls["count"] = 0
+            start = time.perf_counter()
+            generate(PROMPTS[i % len(PROMPTS)])
+            latencies.append(time.perf_counter() - start)
+            per_request.append(calls["count"])
+    finally:
+        app.model.sample = original_sample
+
+    return {
+        "calls_per_request": statistics.mean(per_request),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+def run_streaming(requests):
+    """Measure time to the first streamed choice against time to all three choices."""
+    first, full = [], []
+    for i in range(requests):
+        start = time.perf_counter()
+        for n, _ in enumerate(app.iter_choices(PROMPTS[i % len(PROMPTS)], stream=True)):
+            if n == 0:
+                first.append(time.perf_counter() - start)
+        full.append(time.perf_counter() - start)
+    return {
+        "first_p50_ms": percentile(first, 50) * 1000, "first_p95_ms": percentile(first, 95) * 1000,
+        "full_p50_ms": percentile(full, 50) * 1000, "full_p95_ms": percentile(full, 95) * 1000,
+    }
+
+def run_concurrent(concurrency, requests):
+    """Drive generate_choices from `concurrency` threads and report throughput."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(app.generate_choices, [PROMPTS[i % len(PROMPTS)] for i in range(requests)]))
+    elapsed = time.perf_counter() - start
+    return {"requests_per_sec": requests / elapsed, "model": app.model.health()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark choice generation latency.")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="run concurrent sessions through the batching scheduler instead")
+    parser.add_argument("--stream", action="store_true", help="measure time to the first streamed choice")
+    args = parser.parse_args()
+
+    if args.stream:
+        result = run_streaming(args.requests)
+        print(f"first choice p50={result['first_p50_ms']:.1f}ms p95={result['first_p95_ms']:.1f}ms; "
+              f"all choices p50={result['full_p50_ms']:.1f}ms p95={result['full_p95_ms']:.1f}ms")
+        raise SystemExit
+
+    if args.concurrency:
+        result = run_concurrent(args.concurrency, args.requests)
+        print(f"concurrency={args.concurrency} throughput={result['requests_per_sec']:.2f} req/s")
+        print(f"model: {result['model']}")
+        raise SystemExit
+
+    for name, generate in (("legacy", legacy_generate_choices), ("batched", app.generate_choices)):
+        result = run(generate, args.requests)
+        print(f"{name:8} calls/request={result['calls_per_request']:.2f} "
+              f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms")
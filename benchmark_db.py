@@ -0,0 +1,62 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+def legacy_save_narrative(db_path, user_id, narrative):
+    """The original pattern: a fresh connection per statement."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("REPLACE INTO stories (user_id, narrative) VALUES (?, ?)", (user_id, narrative))
+    conn.commit()
+    conn.close()
+
+def legacy_get_narrative(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT narrative FROM stories WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def run(save, load, threads, ops):
+    """Run `ops` writes and then `ops` reads on each of `threads` threads; return ops/sec for each."""
+    def writer(worker):
+        for i in range(ops):
+            save(f"user-{worker}-{i % 50}", "Once upon a time. " * 20)
+
+    def reader(worker):
+        for i in range(ops):
+            load(f"user-{worker}-{i % 50}")
+
+    rates = {}
+    for name, task in (("writes", writer), ("reads", reader)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(task, range(threads)))
+        rates[name] = threads * ops / (time.perf_counter() - start)
+    return rates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-call connections with the shared storage layer.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before_db, after_db = os.path.join(tmp, "before.db"), os.path.join(tmp, "after.db")
+        conn = sqlite3.connect(before_db)
+        conn.execute("CREATE TABLE stories (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT UNIQUE, narrative TEXT)")
+        conn.close()
+
+        before = run(lambda u, n: legacy_save_narrative(before_db, u, n),
+                     lambda u: legacy_get_narrative(before_db, u), args.threads, args.ops)
+        after = run(lambda u, n: storage.save_narrative(u, n, db_path=after_db),
+                    lambda u: storage.get_narrative(u, db_path=after_db), args.threads, args.ops)
+
+    for name, rates in (("before", before), ("after", after)):
+        print(f"{name:7} writes/s={rates['writes']:.0f} reads/s={rates['reads']:.0f}")
@@ -0,0 +1,282 @@
+import argparse
+import html
+import http.cookiejar
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+PROMPTS = [
+    "A young wizard finds an ancient book in the library.",
+    "A spaceship crashes in your backyard at midnight.",
+    "A coded letter arrives at the detective's desk.",
+]
+BACKENDS = ("fake", "local", "worker", "template")  # see model_worker.BACKENDS
+CHOICE_PATTERN = re.compile(r'name="choice" value="([^"]*)"')
+SSE_CHOICE_PATTERN = re.compile(r"event: choice\ndata: (.*)\n")
+
+class FlaskClientDriver:
+    """Sends requests through Flask's test client, in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+class HTTPDriver:
+    """Sends requests to a running server over HTTP, keeping cookies per simulated user."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=300) as response:
+                return response.status, response.read().decode("utf-8")
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode("utf-8", "replace")
+
+class Recorder:
+    """Collects per-endpoint latencies and server-side DB/model time from all threads."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.seconds = defaultdict(float)
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def request(self, driver, endpoint, method, path, data=None):
+        start = time.perf_counter()
+        status, text = driver.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if status >= 400:
+                self.errors += 1
+        return text
+
+    def add_seconds(self, bucket, seconds):
+        with self._lock:
+            self.seconds[bucket] += seconds
+
+def page_choices(recorder, driver, page):
+    """Return the choices on a story page, following the SSE stream when they are not inline."""
+    choices = [html.unescape(choice) for choice in CHOICE_PATTERN.findall(page)]
+    if choices or "EventSource" not in page:
+        return choices
+    stream = recorder.request(driver, "/choices/stream", "GET", "/choices/stream")
+    return [json.loads(data) for data in SSE_CHOICE_PATTERN.findall(stream)]
+
+def run_session(recorder, driver, depth, seed, think=0.0):
+    """Play one story: start it, pick `depth` choices (reading for `think` seconds first), then view the ending."""
+    rng = random.Random(seed)
+    page = recorder.request(driver, "/", "POST", "/", {"user_prompt": rng.choice(PROMPTS)})
+    for _ in range(depth):
+        choices = page_choices(recorder, driver, page)
+        if not choices:
+            break
+        time.sleep(think)
+        page = recorder.request(driver, "/story", "POST", "/story", {"choice": rng.choice(choices)})
+    page_choices(recorder, driver, page)
+    recorder.request(driver, "/ending", "GET", "/ending")
+
+def instrument(app_module, recorder):
+    """Wrap the app's model backend and storage calls so their time is recorded."""
+    def timed(fn, bucket):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                recorder.add_seconds(bucket, time.perf_counter() - start)
+        return wrapper
+
+    def timed_iter(fn, bucket):
+        def wrapper(*args, **kwargs):
+            iterator = iter(fn(*args, **kwargs))
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    recorder.add_seconds(bucket, time.perf_counter() - start)
+                yield item
+        return wrapper
+
+    model = app_module.model
+    model.sample = timed(model.sample, "model")
+    model.stream = timed_iter(model.stream, "model")
+    app_module.narratives.append = timed(app_module.narratives.append, "db")
+    app_module.narratives.get = timed(app_module.narratives.get, "db")
+    if app_module.choice_cache:
+        app_module.choice_cache.get = timed(app_module.choice_cache.get, "db")
+        app_module.choice_cache.put = timed(app_module.choice_cache.put, "db")
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(recorder, elapsed, peak_rss_mb):
+    endpoints = {
+        endpoint: {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+        for endpoint, samples in sorted(recorder.latencies.items())
+    }
+    requests = sum(len(samples) for samples in recorder.latencies.values())
+    return {
+        "endpoints": endpoints,
+        "requests": requests,
+        "errors": recorder.errors,
+        "requests_per_sec": requests / elapsed,
+        "db_seconds": recorder.seconds.get("db"),
+        "model_seconds": recorder.seconds.get("model"),
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+def run_flask(args):
+    """Benchmark the app in this process through the Flask test client."""
+    import app as app_module
+    recorder = Recorder()
+    instrument(app_module, recorder)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(lambda seed: run_session(recorder, FlaskClientDriver(app_module.app), args.depth, seed, args.think),
+                      range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    return summarize(recorder, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+def run_gunicorn(args):
+    """Benchmark a real local gunicorn server; DB/model time is not visible from outside it."""
+    import psutil
+    server = subprocess.Popen([
+        sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{args.port}",
+        "--workers", str(args.workers), "--threads", str(args.threads), "--timeout", "300", "app:app",
+    ])
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        deadline = time.time() + 300
+        while True:
+            try:
+                urllib.request.urlopen(base_url + "/", timeout=5).read()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.5)
+
+        recorder = Recorder()
+        peak_rss = [0]
+        done = threading.Event()
+
+        def sample_rss():
+            process = psutil.Process(server.pid)
+            while not done.is_set():
+                try:
+                    rss = sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+                except psutil.Error:
+                    rss = 0
+                peak_rss[0] = max(peak_rss[0], rss)
+                done.wait(0.2)
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda seed: run_session(recorder, HTTPDriver(base_url), args.depth, seed, args.think),
+                          range(args.sessions)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        return summarize(recorder, elapsed, peak_rss[0] / 2**20)
+    finally:
+        server.terminate()
+        server.wait()
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def compare(current, previous):
+    """Print latency changes per endpoint against an earlier results file."""
+    print(f"compared with {previous.get('commit')} ({previous['config']['server']}, {previous['config']['backend']}):")
+    for endpoint, stats in current["endpoints"].items():
+        before = previous["endpoints"].get(endpoint)
+        if not before:
+            continue
+        changes = ", ".join(f"{key} {stats[key] - before[key]:+.1f}ms" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"  {endpoint:16} {changes}")
+    delta = current["requests_per_sec"] - previous["requests_per_sec"]
+    print(f"  requests/sec {delta:+.2f}")
+
+def backend_spec(value):
+    """Validate a MODEL_BACKEND value: a backend name or a comma-separated fallback chain."""
+    # Listed here rather than imported: model_worker reads its settings from
+    # the environment on import, before main() has set them.
+    unknown = [name for name in value.split(",") if name.strip() not in BACKENDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown backend {unknown[0]!r}; choose from {', '.join(BACKENDS)}")
+    return value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the story endpoints.")
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    parser.add_argument("--backend", type=backend_spec, default="fake",
+                        help="model backend: fake (deterministic stub), local (in-process GPT-2), worker (the "
+                             "worker pool), template (trigram model), or a fallback chain such as local,template")
+    parser.add_argument("--latency-budget", type=float, default=0,
+                        help="milliseconds before a fallback chain moves to its next backend (0 waits)")
+    parser.add_argument("--sessions", type=int, default=20, help="stories to play")
+    parser.add_argument("--concurrency", type=int, default=4, help="stories played at once")
+    parser.add_argument("--depth", type=int, default=3, help="choices made per story")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds a user reads before choosing")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    os.environ["MODEL_BACKEND"] = args.backend
+    os.environ["MODEL_LATENCY_BUDGET_MS"] = str(args.latency_budget)
+    result = run_flask(args) if args.server == "flask" else run_gunicorn(args)
+    result.update(commit=git_commit(), timestamp=time.time(), config={
+        "server": args.server, "backend": args.backend, "latency_budget": args.latency_budget, "sessions": args.sessions,
+        "concurrency": args.concurrency, "depth": args.depth, "think": args.think,
+    })
+
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:16} n={stats['count']:<4} p50={stats['p50_ms']:.1f}ms "
+              f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+    server_time = "n/a" if result["db_seconds"] is None else \
+        f"db={result['db_seconds']:.2f}s model={result['model_seconds'] or 0:.2f}s"
+    print(f"requests/sec={result['requests_per_sec']:.2f} errors={result['errors']} "
+          f"peak_rss={result['peak_rss_mb']:.0f}MB {server_time}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            compare(result, json.load(file))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+PROMPTS = [
+    "A young wizard finds an ancient book in the library.",
+    "A spaceship crashes in your backyard at midnight.",
+    "A coded letter arrives at the detective's desk.",
+]
+
+# Each mode runs in its own process so RSS and thread settings don't leak between them.
+MODES = {
+    "fp32": {"QUANTIZE": "none"},
+    "int8": {"QUANTIZE": "int8"},
+    "int8-compiled": {"QUANTIZE": "int8", "TORCH_COMPILE": "1"},
+}
+# A mode fails the quality check when its choice-filter pass rate drops this far below fp32.
+QUALITY_TOLERANCE = 0.10
+
+def measure(rounds, count):
+    """Generate candidates for the benchmark prompts in this process and report speed, quality and memory."""
+    import generation
+    from app import extract_choice
+
+    start = time.perf_counter()
+    generation.get_generator()
+    load_seconds = time.perf_counter() - start
+    tokenizer = generation.get_generator().tokenizer
+
+    tokens = passed = total = 0
+    start = time.perf_counter()
+    for i in range(rounds):
+        texts = generation.sample_candidates_batch([PROMPTS[i % len(PROMPTS)] + generation.PROMPT_SUFFIX], count)[0]
+        tokens += sum(len(tokenizer(text).input_ids) for text in texts)
+        passed += sum(1 for text in texts if extract_choice(text))
+        total += len(texts)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "load_seconds": load_seconds,
+        "tokens_per_sec": tokens / elapsed,
+        "pass_rate": passed / total,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def run_mode(name, rounds, count, threads):
+    env = dict(os.environ, MODEL_BACKEND="local", BATCH_WINDOW_MS="0", CHOICE_CACHE_SIZE="0", **MODES[name])
+    if threads:
+        env["TORCH_THREADS"] = str(threads)
+    output = subprocess.run([sys.executable, __file__, "--child", "--rounds", str(rounds), "--count", str(count)],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CPU inference modes for the GPT-2 generator.")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8"], choices=sorted(MODES))
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--count", type=int, default=6, help="candidates sampled per round")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = default)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.rounds, args.count)))
+        raise SystemExit
+
+    results = {name: run_mode(name, args.rounds, args.count, args.threads) for name in args.modes}
+    baseline = results.get("fp32")
+    for name, result in results.items():
+        quality = ""
+        if baseline and name != "fp32":
+            ok = result["pass_rate"] >= baseline["pass_rate"] - QUALITY_TOLERANCE
+            quality = " quality=" + ("ok" if ok else "DEGRADED")
+        print(f"{name:14} tokens/s={result['tokens_per_sec']:.1f} pass_rate={result['pass_rate']:.2f} "
+              f"rss={result['peak_rss_mb']:.0f}MB load={result['load_seconds']:.1f}s{quality}")
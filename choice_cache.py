@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from storage import DB_PATH, query_all, query_one, transaction
+
+STORY_DATA_PATH = "story_data.json"
+PRUNE_EVERY = 100  # puts between sweeps of the persistent tier
+
+def cache_key(narrative, params):
+    """Hash the whitespace-normalized narrative together with the generation parameters."""
+    normalized = " ".join(narrative.split())
+    payload = json.dumps([normalized, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ChoiceCache:
+    """Two-tier cache of generated choices: an in-memory LRU in front of a SQLite table.
+
+    Entries older than `ttl` seconds are treated as misses in both tiers.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_entries=1024, max_db_entries=100000, ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_db_entries = max_db_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    def get(self, key):
+        """Return the cached list of choices for a key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item and now - item[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return list(item[0])
+
+        row = query_one("SELECT choices, created_at FROM choice_cache WHERE key = ? AND created_at > ?",
+                        (key, now - self.ttl), self.db_path)
+        with self._lock:
+            if not row:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            choices = json.loads(row[0])
+            self._remember(key, choices, row[1])
+            return list(choices)
+
+    def put(self, key, choices):
+        """Store choices in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, list(choices), now)
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+
+        with transaction(self.db_path) as conn:
+            conn.execute("REPLACE INTO choice_cache (key, choices, created_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(choices), now))
+            if prune:
+                self._prune(conn, now)
+
+    def _prune(self, conn, now):
+        """Drop expired rows and trim the persistent tier to `max_db_entries`."""
+        conn.execute("DELETE FROM choice_cache WHERE created_at <= ?", (now - self.ttl,))
+        conn.execute("""
+            DELETE FROM choice_cache WHERE key IN (
+                SELECT key FROM choice_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_db_entries,))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+            }
+
+    def _remember(self, key, choices, created_at):
+        self._memory[key] = (choices, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+def seed_prompts(db_path=DB_PATH, story_data_path=STORY_DATA_PATH):
+    """Collect the seed prompts users most often start from: story templates and dataset prompts."""
+    prompts = []
+    if os.path.exists(story_data_path):
+        with open(story_data_path, "r", encoding="utf-8") as file:
+            prompts.extend(story["prompt"] for story in json.load(file))
+    prompts.extend(row[0] for row in query_all("SELECT text FROM story_templates", db_path=db_path))
+    return list(dict.fromkeys(prompts))
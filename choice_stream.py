@@ -0,0 +1,92 @@
+import queue
+
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+
+class ChoiceStreamer(BaseStreamer):
+    """Token streamer for a batch of sampled continuations.
+
+    Each row is handed over on `queue` as soon as its first sentence is
+    complete (or it hits end-of-text), which is all a choice needs. `None`
+    is queued once generation ends. Setting `cancelled` stops generation
+    at the next step through StopWhenFinished.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.queue = queue.Queue()
+        self.cancelled = False
+        self._prompt_seen = False
+        self._ended = False
+        self._rows = None
+        self._done = None
+
+    def put(self, value):
+        # generate() first passes the prompt ids; only the new tokens matter here.
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if self._rows is None:
+            self._rows = [[] for _ in range(len(value))]
+            self._done = [False] * len(value)
+        for row, token in enumerate(value.tolist()):
+            if self._done[row]:
+                continue
+            if token == self.tokenizer.eos_token_id:
+                self._finish(row)
+                continue
+            self._rows[row].append(token)
+            if "." in self.tokenizer.decode([token]):
+                self._finish(row)
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+        for row, done in enumerate(self._done or []):
+            if not done:
+                self._finish(row)
+        self.queue.put(None)
+
+    @property
+    def finished(self):
+        return self.cancelled or (self._done is not None and all(self._done))
+
+    def _finish(self, row):
+        self._done[row] = True
+        self.queue.put(self.tokenizer.decode(self._rows[row], skip_special_tokens=True))
+
+class BatchStreamer(BaseStreamer):
+    """Hand the rows of a batched generate call to one streamer per prompt.
+
+    `streamers` has an entry per prompt, each owning `count` consecutive
+    rows; prompts with no streamer (None) are generated in full, so the
+    batch only counts as finished once every prompt has a streamer that is.
+    """
+
+    def __init__(self, streamers, count):
+        self.streamers = streamers
+        self.count = count
+
+    def put(self, value):
+        for i, streamer in enumerate(self.streamers):
+            if streamer:
+                streamer.put(value[i * self.count:(i + 1) * self.count])
+
+    def end(self):
+        for streamer in self.streamers:
+            if streamer:
+                streamer.end()
+
+    @property
+    def finished(self):
+        return all(streamer and streamer.finished for streamer in self.streamers)
+
+class StopWhenFinished(StoppingCriteria):
+    """Stop generating once every row has been streamed out, or the consumer went away."""
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.streamer.finished
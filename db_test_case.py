@@ -0,0 +1,16 @@
+import os
+import tempfile
+import unittest
+
+import storage
+
+class DatabaseTestCase(unittest.TestCase):
+    """Base for tests that need a fresh story database: `self.db_path` inside `self.tmp`."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        storage.close_connection(self.db_path)
+        self.tmp.cleanup()
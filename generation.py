@@ -0,0 +1,290 @@
+import os
+import threading
+
+import torch
+from transformers import StoppingCriteriaList, pipeline, logging as hf_logging
+from transformers.pytorch_utils import Conv1D
+
+import metrics
+from batch_scheduler import BatchScheduler
+from choice_stream import BatchStreamer, ChoiceStreamer, StopWhenFinished
+from kv_cache import SessionKVCache, SessionState, past_size
+from model_worker import ChoiceGenerator, ModelUnavailable
+from prompt_builder import PromptBuilder
+
+hf_logging.set_verbosity_error()  # Suppress unnecessary warnings
+
+MODEL_NAME = os.environ.get("STORY_MODEL", "gpt2")
+
+# CPU inference tuning. QUANTIZE=int8 applies dynamic int8 quantization to the
+# linear layers; thread counts of 0 keep torch's defaults.
+QUANTIZE = os.environ.get("QUANTIZE", "none")
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", 0))
+TORCH_INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", 0))
+USE_INFERENCE_MODE = os.environ.get("USE_INFERENCE_MODE", "1") == "1"
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+
+PROMPT_SUFFIX = "\nWhat happens next?"
+MAX_NEW_TOKENS = 40
+TEMPERATURE = 0.9
+TOP_P = 0.95
+
+# Narratives are given to the model within this many tokens: a summary of the
+# older turns (up to PROMPT_SUMMARY_TOKENS) followed by the recent ones verbatim.
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 512))
+PROMPT_SUMMARY_TOKENS = int(os.environ.get("PROMPT_SUMMARY_TOKENS", 128))
+
+# Everything that changes what the model produces for a narrative; used in choice cache keys.
+GENERATION_PARAMS = {
+    "model": MODEL_NAME, "suffix": PROMPT_SUFFIX, "max_new_tokens": MAX_NEW_TOKENS,
+    "temperature": TEMPERATURE, "top_p": TOP_P, "quantize": QUANTIZE,
+    "prompt_budget": [PROMPT_TOKEN_BUDGET, PROMPT_SUMMARY_TOKENS],
+}
+
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 20))
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 8))
+
+# Per-session key/value cache for the narrative prefix, off by default.
+# Sessions served from it are not micro-batched; see `scheduler` for the
+# trade-off.
+SESSION_KV_CACHE_MB = float(os.environ.get("SESSION_KV_CACHE_MB", 0))
+SESSION_KV_CACHE_TTL = int(os.environ.get("SESSION_KV_CACHE_TTL", 1800))
+# When a prompt no longer fits GPT-2's context, only its most recent tokens are
+# kept, trimmed to this fraction of the window so re-encoding stays rare.
+CONTEXT_KEEP_RATIO = 0.75
+
+_generator = None
+_load_lock = threading.Lock()
+
+def get_generator():
+    """Return the text-generation pipeline, loading the model on first use."""
+    global _generator
+    if _generator is None:
+        with _load_lock:
+            if _generator is None:
+                if TORCH_THREADS:
+                    torch.set_num_threads(TORCH_THREADS)
+                if TORCH_INTEROP_THREADS:
+                    torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+                generator = pipeline("text-generation", model=MODEL_NAME)
+                generator.model = optimize_model(generator.model)
+                _generator = generator
+    return _generator
+
+def conv1d_to_linear(model):
+    """Replace GPT-2's Conv1D projections with equivalent nn.Linear layers so they can be quantized."""
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if type(child) is Conv1D:
+                linear = torch.nn.Linear(*child.weight.shape)
+                linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+                linear.bias = child.bias
+                setattr(parent, name, linear)
+    return model
+
+def optimize_model(model):
+    """Apply the configured CPU inference optimizations to a freshly loaded model."""
+    model.eval()
+    if QUANTIZE == "int8":
+        model = torch.ao.quantization.quantize_dynamic(conv1d_to_linear(model), {torch.nn.Linear},
+                                                      dtype=torch.qint8, inplace=True)
+    elif QUANTIZE != "none":
+        raise ValueError(f"Unknown QUANTIZE mode: {QUANTIZE}")
+    if TORCH_COMPILE:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+def inference_context():
+    """Grad-free context for model calls; inference_mode also skips autograd bookkeeping."""
+    return torch.inference_mode() if USE_INFERENCE_MODE else torch.no_grad()
+
+def is_loaded():
+    return _generator is not None
+
+def context_window():
+    """Number of prompt tokens that fit alongside MAX_NEW_TOKENS generated ones."""
+    return get_generator().model.config.n_positions - MAX_NEW_TOKENS
+
+def truncate_context(ids, limit):
+    """Apply the sliding-window policy: keep the tail of `ids` once it exceeds `limit`."""
+    return ids[-int(limit * CONTEXT_KEEP_RATIO):] if len(ids) > limit else ids
+
+def generate_from_prefix(input_ids, attention_mask, prefix, count, streamer=None):
+    """Sample `count` continuations per row, reusing `prefix` key/values for all but the last token.
+
+    With a streamer (ChoiceStreamer or BatchStreamer), rows are handed to
+    it as they finish and generation stops early once all of them have.
+    """
+    def expand(t):
+        return t.expand(count, *t.shape[1:]) if t.shape[0] == 1 else t.repeat_interleave(count, dim=0)
+
+    generator = get_generator()
+    tokenizer = generator.tokenizer
+    past = tuple(tuple(expand(t) for t in layer) for layer in prefix) if prefix else None
+    with inference_context():
+        output = generator.model.generate(
+            expand(input_ids), attention_mask=expand(attention_mask), past_key_values=past,
+            do_sample=True, max_new_tokens=MAX_NEW_TOKENS, temperature=TEMPERATURE, top_p=TOP_P,
+            pad_token_id=tokenizer.eos_token_id, streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([StopWhenFinished(streamer)]) if streamer else None
+        )
+    new_tokens = output[:, input_ids.shape[1]:]
+    metrics.inc("story_tokens_generated_total", int((new_tokens != tokenizer.eos_token_id).sum()))
+    return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+def sample_candidates_batch(prompts, count, streamers=None):
+    """Sample `count` continuations for each prompt in a single batched generate call.
+
+    Prompts are left-padded into one batch and encoded once; the prompt
+    key/value cache is then shared by every sequence sampled from it, so
+    only the new tokens are computed per candidate. `streamers` optionally
+    gives a ChoiceStreamer (or None) per prompt.
+    """
+    generator = get_generator()
+    tokenizer, model = generator.tokenizer, generator.model
+    encoded = [truncate_context(tokenizer(prompt).input_ids, context_window()) or [tokenizer.eos_token_id]
+               for prompt in prompts]
+    width = max(len(ids) for ids in encoded)
+    input_ids = torch.tensor([[tokenizer.eos_token_id] * (width - len(ids)) + ids for ids in encoded], device=model.device)
+    attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded], device=model.device)
+    prefix = None
+    if width > 1:
+        position_ids = (attention_mask[:, :-1].cumsum(-1) - 1).clamp(min=0)
+        with inference_context():
+            prefix = model(input_ids[:, :-1], attention_mask=attention_mask[:, :-1],
+                           position_ids=position_ids, use_cache=True).past_key_values
+    streamer = BatchStreamer(streamers, count) if streamers and any(streamers) else None
+    texts = generate_from_prefix(input_ids, attention_mask, prefix, count, streamer)
+    return [texts[i * count:(i + 1) * count] for i in range(len(prompts))]
+
+def sample_requests_batch(requests, count):
+    """Scheduler entry point: sample for a batch of (prompt, streamer) requests."""
+    prompts, streamers = zip(*requests)
+    return sample_candidates_batch(list(prompts), count, list(streamers))
+
+# Concurrent requests share forward passes through the micro-batching
+# scheduler, streamed or not; each streamed request gets its own rows of the
+# batch. Sessions served from the session key/value cache bypass it: a turn
+# then encodes only the new tokens instead of the whole prompt, but cannot
+# share a batch, and each cached session holds about 36 MB (a full
+# 512-token GPT-2 prompt). Prompts are already capped at PROMPT_TOKEN_BUDGET,
+# so by default every request is batched instead; set SESSION_KV_CACHE_MB
+# for few, long-running sessions on a host with the memory to spare.
+scheduler = BatchScheduler(sample_requests_batch, BATCH_WINDOW_MS / 1000, MAX_BATCH_SIZE) if BATCH_WINDOW_MS > 0 else None
+session_cache = SessionKVCache(int(SESSION_KV_CACHE_MB * 2**20), SESSION_KV_CACHE_TTL) if SESSION_KV_CACHE_MB > 0 else None
+
+prompts = PromptBuilder(lambda: get_generator().tokenizer, PROMPT_TOKEN_BUDGET, PROMPT_SUMMARY_TOKENS)
+
+def sample_candidates(prompt, count, streamer=None):
+    """Sample `count` continuations of the prompt, batched with other requests when enabled."""
+    if scheduler:
+        return scheduler.generate((prompt, streamer), count)
+    return sample_candidates_batch([prompt], count, [streamer])[0]
+
+def encode_tokens(ids, past=None):
+    """Run the model over `ids` following `past` and return the extended key/values."""
+    model = get_generator().model
+    with inference_context():
+        return model(torch.tensor([ids], device=model.device), past_key_values=past, use_cache=True).past_key_values
+
+def session_state(session_id, narrative):
+    """Return the session's cached prompt state, encoding only the newly appended text.
+
+    `narrative` is the budgeted prompt text, which only changes by appending
+    between PromptBuilder compressions.
+    """
+    tokenizer = get_generator().tokenizer
+    limit = context_window() - len(tokenizer(PROMPT_SUFFIX).input_ids)
+    state = session_cache.get(session_id)
+    if state and narrative == state.text:
+        return state
+
+    if state and narrative.startswith(state.text):
+        new_ids = tokenizer(narrative[len(state.text):]).input_ids
+        ids = state.ids + new_ids
+        past = encode_tokens(new_ids, state.past) if len(ids) <= limit else None
+    else:
+        ids = tokenizer(narrative).input_ids or [tokenizer.eos_token_id]
+        past = None
+    if past is None:
+        # Positions are absolute in GPT-2, so a trimmed window is re-encoded from scratch.
+        ids = truncate_context(ids, limit)
+        past = encode_tokens(ids)
+
+    state = SessionState(narrative, ids, past, past_size(past))
+    session_cache.put(session_id, state)
+    return state
+
+def sample_session_candidates(session_id, narrative, count, streamer=None):
+    """Sample continuations for a session, reusing its cached narrative key/values."""
+    generator = get_generator()
+    state = session_state(session_id, narrative)
+    suffix_ids = generator.tokenizer(PROMPT_SUFFIX).input_ids
+    prefix = encode_tokens(suffix_ids[:-1], state.past) if len(suffix_ids) > 1 else state.past
+    input_ids = torch.tensor([state.ids + suffix_ids], device=generator.model.device)
+    return generate_from_prefix(input_ids, torch.ones_like(input_ids), prefix, count, streamer)
+
+def sample(narrative, session_id=None, count=1):
+    """Sample `count` raw continuations of the narrative."""
+    context = prompts.build(narrative, session_id)
+    if session_id and session_cache:
+        return sample_session_candidates(session_id, context, count)
+    return sample_candidates(context + PROMPT_SUFFIX, count)
+
+def stream(narrative, session_id=None, count=1):
+    """Yield sampled continuations one by one, as soon as each has a complete first sentence."""
+    streamer = ChoiceStreamer(get_generator().tokenizer)
+    context = prompts.build(narrative, session_id)
+    errors = []
+
+    def run():
+        try:
+            if session_id and session_cache:
+                sample_session_candidates(session_id, context, count, streamer)
+            else:
+                sample_candidates(context + PROMPT_SUFFIX, count, streamer)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            streamer.end()
+
+    threading.Thread(target=run, name="choice-stream", daemon=True).start()
+    try:
+        while (text := streamer.queue.get()) is not None:
+            yield text
+    finally:
+        streamer.cancelled = True  # stops generation if the consumer stopped early
+    if errors:
+        raise errors[0]
+
+def stats():
+    return {
+        "loaded": is_loaded(),
+        "scheduler": scheduler.stats() if scheduler else None,
+        "session_cache": session_cache.stats() if session_cache else None,
+        "prompts": prompts.stats(),
+    }
+
+class LocalModel(ChoiceGenerator):
+    """Model backend that runs GPT-2 inside the current process.
+
+    Failures to load the model or to generate are raised as
+    ModelUnavailable, so a fallback chain moves on to its next backend.
+    """
+
+    params = GENERATION_PARAMS
+
+    def sample(self, narrative, session_id=None, count=1):
+        try:
+            return sample(narrative, session_id, count)
+        except Exception as e:
+            raise ModelUnavailable(f"local model failed: {e}") from e
+
+    def stream(self, narrative, session_id=None, count=1):
+        try:
+            yield from stream(narrative, session_id, count)
+        except Exception as e:
+            raise ModelUnavailable(f"local model failed: {e}") from e
+
+    def health(self):
+        return [dict(stats(), ok=True, pid=os.getpid())]
@@ -1,57 +1,31 @@
-import sqlite3
-import random
-import json
+import storage
+from story_graph import StoryGraphLoader
 
-DB_PATH = "story_database.db"
+# Stories are read from memory; the graph reloads itself when the DB changes.
+story_graph = StoryGraphLoader(storage.DB_PATH)
 
 def get_story_by_id(story_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT story_id, title, prompt FROM stories WHERE story_id = ?", (story_id,))
-        story = cursor.fetchone()
-        conn.close()
-        return story
+        return story_graph.get().node(story_id)
     except Exception as e:
         print(f"Error fetching story by ID: {e}")
         return None
 
-def get_choices_for_story(story_id):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT choice_id, choice_text, outcome, next_story_id FROM choices WHERE story_id = ?", (story_id,))
-        choices = cursor.fetchall()
-        conn.close()
-        return choices
-    except Exception as e:
-        print(f"Error fetching choices: {e}")
-        return []
+def update_user_progress(user_id, story_id, new_entries=(), reset=False):
+    """Record the current story node, appending only the narrative entries added since the last save.
 
-def update_user_progress(user_id, story_id, narrative):
+    `reset` starts a new narrative, discarding the previous story's entries.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_progress (user_id, current_story_id, narrative) 
-            VALUES (?, ?, ?)
-        """, (user_id, story_id, json.dumps(narrative)))
-        conn.commit()
-        conn.close()
+        storage.save_user_progress(user_id, story_id, new_entries, reset)
     except Exception as e:
         print(f"Error updating user progress: {e}")
 
 def get_user_progress(user_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT current_story_id, narrative FROM user_progress WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = storage.get_user_progress(user_id)
         if result:
-            story_id, narrative_json = result
-            narrative = json.loads(narrative_json) if narrative_json else []
-            return story_id, narrative
+            return result
         return None, []
     except Exception as e:
         print(f"Error retrieving user progress: {e}")
@@ -59,14 +33,7 @@ def get_user_progress(user_id):
 
 def choose_random_story():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT story_id FROM stories ORDER BY RANDOM() LIMIT 1")
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            return row[0]
-        return None
+        return story_graph.get().random_start()
     except Exception as e:
         print(f"Error choosing random story: {e}")
         return None
@@ -87,7 +54,7 @@ def interactive_story():
             print("⚠️ No stories available in the database!")
             return
         narrative = []
-        update_user_progress(user_id, current_story_id, narrative)
+        update_user_progress(user_id, current_story_id, reset=True)
 
     # Main interactive loop
     while True:
@@ -96,23 +63,22 @@ def interactive_story():
             print("⚠️ Story not found! Ending session.")
             break
 
-        story_id, title, prompt = story
         print("\n----------------------------------")
-        print(f"Story: {title}")
-        print(prompt)
+        print(f"Story: {story.title}")
+        print(story.prompt)
 
-        # Append the current prompt to the narrative.
-        narrative.append(f"Story: {title}\n{prompt}")
+        # The current prompt starts this turn's narrative entry.
+        entry = f"Story: {story.title}\n{story.prompt}"
 
-        # Fetch and display choices
-        choices = get_choices_for_story(story_id)
+        # Display choices
+        choices = story.choices
         if not choices:
             print("🔚 No choices available. The story ends here.")
             break
 
         print("\n🔹 Choose an option:")
-        for idx, (choice_id, choice_text, outcome, next_story_id) in enumerate(choices, start=1):
-            print(f"{idx}. {choice_text} -> {outcome}")
+        for idx, choice in enumerate(choices, start=1):
+            print(f"{idx}. {choice.text} -> {choice.outcome}")
 
         # Get valid user input
         try:
@@ -126,21 +92,22 @@ def interactive_story():
 
         selected_choice = choices[choice_input - 1]
         # Instead of printing a separate confirmation, directly append outcome to narrative.
-        outcome = selected_choice[2]
+        outcome = selected_choice.outcome
         print(f"\n{outcome}\n")
-        narrative[-1] += f" -> {outcome}"  # Append outcome directly to the previous prompt narrative.
+        entry += f" -> {outcome}"  # Append outcome directly to the prompt narrative.
+        narrative.append(entry)
 
-        next_story_id = selected_choice[3]
+        next_story_id = selected_choice.next_story_id
         if next_story_id is None:
             print("🎬 The story has reached an ending. Thank you for playing!")
-            update_user_progress(user_id, None, narrative)
+            update_user_progress(user_id, None, [entry])
             print("\n----- Full Story Narrative -----\n")
             for entry in narrative:
                 print(entry)
             break
         else:
             current_story_id = next_story_id
-            update_user_progress(user_id, current_story_id, narrative)
+            update_user_progress(user_id, current_story_id, [entry])
 
 if __name__ == "__main__":
     interactive_story()
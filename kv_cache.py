@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# `text` is the narrative the entry was built from, `ids` the token ids
+# covered by `past` (the model's key/value tensors for those tokens).
+SessionState = namedtuple("SessionState", ["text", "ids", "past", "size"])
+
+def past_size(past):
+    """Return the number of bytes held by a tuple of key/value tensors."""
+    return sum(t.numel() * t.element_size() for layer in past for t in layer) if past else 0
+
+class SessionKVCache:
+    """Per-session LRU cache of the model's key/values for the narrative so far.
+
+    Entries are evicted least-recently-used first once the total size goes
+    over `max_bytes`, and after `ttl` seconds without being touched.
+    """
+
+    def __init__(self, max_bytes, ttl=1800):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id):
+        """Return the cached SessionState for a session, or None."""
+        with self._lock:
+            self._expire()
+            item = self._entries.get(session_id)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries[session_id] = (item[0], time.monotonic())
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, session_id, state):
+        """Store the state for a session, evicting older sessions to stay under the cap."""
+        with self._lock:
+            self._discard(session_id)
+            if state.size > self.max_bytes:
+                return
+            self._entries[session_id] = (state, time.monotonic())
+            self._size += state.size
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def drop(self, session_id):
+        with self._lock:
+            self._discard(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+    def _discard(self, session_id):
+        item = self._entries.pop(session_id, None)
+        if item:
+            self._size -= item[0].size
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            session_id, (_, touched) = next(iter(self._entries.items()))
+            if touched >= cutoff:
+                break
+            self._discard(session_id)
@@ -0,0 +1,239 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# One JSON line per request with its stage timings, on stdout.
+METRICS_LOG = os.environ.get("METRICS_LOG", "0") == "1"
+# Fraction of requests run under the sampling profiler; their stacks are
+# reported when the request takes longer than PROFILE_SLOW_MS.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 1000))
+PROFILE_INTERVAL_MS = 5
+PROFILE_TOP_STACKS = 10
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Registry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h[0], list(h[1]), h[2], h[3])) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._help.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value:g}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, "histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+def gauge_lines(prefix, values, **labels):
+    """Render the numeric entries of a (nested) stats dict as untyped gauge lines."""
+    lines = []
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(gauge_lines(name, value, **labels))
+        elif isinstance(value, (bool, int, float)):
+            lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {float(value):g}")
+    return lines
+
+registry = Registry()
+registry.describe("story_requests_total", "counter", "HTTP requests by endpoint and status.")
+registry.describe("story_request_seconds", "histogram", "HTTP request latency, including streamed bodies.")
+registry.describe("story_stage_seconds", "histogram", "Time spent in each stage of a request.")
+registry.describe("story_choice_requests_total", "counter", "Choice lists served, by source: cache, pregenerated, model, degraded "
+                  "(a fallback backend) or fallback (fixed choices).")
+registry.describe("story_generation_attempts", "histogram", "Model calls made per choice list.")
+registry.describe("story_tokens_generated_total", "counter", "Tokens sampled by the model in this process.")
+registry.describe("story_backend_fallbacks_total", "counter", "Model calls handed to the next backend, by position and reason.")
+
+inc = registry.inc
+observe = registry.observe
+
+# --- Per-request context --------------------------------------------------------
+
+_local = threading.local()
+
+def current():
+    """The running request's record, or None outside a request."""
+    return getattr(_local, "record", None)
+
+def note(**fields):
+    """Attach fields to the current request's structured log line."""
+    record = current()
+    if record is not None:
+        record["fields"].update(fields)
+
+@contextmanager
+def span(stage):
+    """Time a stage of the current request; repeated stages add up."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("story_stage_seconds", elapsed, stage=stage)
+        record = current()
+        if record is not None:
+            record["stages"][stage] += elapsed
+
+def timed_iter(iterable, stage):
+    """Yield from `iterable`, timing only the time spent producing each item."""
+    iterator = iter(iterable)
+    while True:
+        with span(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def begin_request(endpoint):
+    record = {"endpoint": endpoint, "start": time.perf_counter(), "stages": defaultdict(float),
+              "fields": {}, "profiler": None}
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        record["profiler"] = SamplingProfiler(threading.get_ident()).start()
+    _local.record = record
+    return record
+
+def end_request(record, status):
+    """Record the request's latency and emit its log line and, if slow, its profile."""
+    if current() is record:
+        _local.record = None
+    elapsed = time.perf_counter() - record["start"]
+    endpoint = record["endpoint"]
+    inc("story_requests_total", endpoint=endpoint, status=status)
+    observe("story_request_seconds", elapsed, endpoint=endpoint)
+
+    profile = None
+    if record["profiler"]:
+        stacks = record["profiler"].stop()
+        if stacks and elapsed * 1000 >= PROFILE_SLOW_MS:
+            profile = stacks
+            on_slow_profile(endpoint, elapsed, stacks)
+    if METRICS_LOG:
+        line = {"endpoint": endpoint, "status": status, "ms": round(elapsed * 1000, 2),
+                "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in record["stages"].items()}}
+        line.update(record["fields"])
+        if profile:
+            line["profiled"] = True
+        print(json.dumps(line), flush=True)
+
+def init_app(app):
+    """Time every request of a Flask app, including responses streamed after the view returns."""
+    from flask import request
+
+    @app.before_request
+    def start_timer():
+        begin_request(request.endpoint or "unknown")
+
+    @app.after_request
+    def stop_timer(response):
+        record = current()
+        if record is None:
+            return response
+        if response.is_streamed:
+            response.call_on_close(lambda: end_request(record, response.status_code))
+        else:
+            end_request(record, response.status_code)
+        return response
+
+# --- Sampling profiler -------------------------------------------------------------
+
+class SamplingProfiler:
+    """Sample one thread's Python stack every PROFILE_INTERVAL_MS from a helper thread.
+
+    Much cheaper than tracing profilers, so it can run on a fraction of
+    production requests. `stop()` returns a Counter of sampled stacks,
+    each a tuple of "file:line function" frames from outermost inwards.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+def print_profile(endpoint, seconds, stacks):
+    """Default slow-request hook: print the most frequently sampled stacks."""
+    total = sum(stacks.values())
+    print(f"Slow request to {endpoint} took {seconds * 1000:.0f}ms; top of {total} stack samples:", flush=True)
+    for stack, count in stacks.most_common(PROFILE_TOP_STACKS):
+        print(f"  {count / total:6.1%}  " + " > ".join(stack[-4:]), flush=True)
+
+# Called with (endpoint, seconds, stacks) for profiled requests slower than
+# PROFILE_SLOW_MS; replace it to ship profiles elsewhere.
+on_slow_profile = print_profile
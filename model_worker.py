@@ -0,0 +1,426 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+
+MODEL_SOCKET = os.environ.get("MODEL_SOCKET", "/tmp/story-model.sock")
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", 2))
+# Requests a model process accepts at once; beyond this it answers "busy"
+# straight away so web workers can fall back instead of queueing.
+MAX_PENDING = int(os.environ.get("MODEL_MAX_PENDING", 16))
+REQUEST_TIMEOUT = float(os.environ.get("MODEL_REQUEST_TIMEOUT", 60))
+HEALTH_INTERVAL = 5
+# With a chain of backends (MODEL_BACKEND=local,template), a call that has not
+# answered within this budget is handed to the next backend. 0 waits forever.
+LATENCY_BUDGET_MS = float(os.environ.get("MODEL_LATENCY_BUDGET_MS", 0))
+# Calls allowed to run at once on each backend of a chain but the last;
+# further calls go straight to the next backend.
+FALLBACK_IN_FLIGHT = int(os.environ.get("MODEL_FALLBACK_IN_FLIGHT", 8))
+
+class ModelUnavailable(Exception):
+    """No model worker could serve the request."""
+
+class ModelBusy(ModelUnavailable):
+    """The model worker is at MAX_PENDING requests and refused this one."""
+
+class ChoiceGenerator:
+    """Interface of the model backends the app generates choices with.
+
+    `params` describes everything that changes the output (it keys the
+    choice cache); `sample` returns `count` raw continuations of the
+    narrative and `stream` yields them as they finish. Backends raise
+    ModelUnavailable when they cannot serve a request.
+    """
+
+    params = {}
+
+    def sample(self, narrative, session_id=None, count=1):
+        raise NotImplementedError
+
+    def stream(self, narrative, session_id=None, count=1):
+        yield from self.sample(narrative, session_id, count)
+
+    def health(self):
+        return [{"ok": True, "pid": os.getpid()}]
+
+    def was_degraded(self):
+        """Whether this thread's last call was answered by a fallback backend."""
+        return False
+
+# --- Model process ------------------------------------------------------------
+
+class ModelRequestHandler(socketserver.StreamRequestHandler):
+    """Answer one JSON-lines request: health, params, sample or stream."""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        op = request.get("op")
+        if op == "health":
+            return self._send(dict(self.server.model.health()[0], pending=self.server.pending))
+        if op == "params":
+            return self._send({"params": self.server.model.params})
+
+        if not self.server.slots.acquire(blocking=False):
+            return self._send({"error": "busy"})
+        self.server.pending += 1
+        try:
+            args = (request["narrative"], request.get("session_id"), request.get("count", 1))
+            if op == "stream":
+                for text in self.server.model.stream(*args):
+                    self._send({"text": text})
+                self._send({"done": True})
+            else:
+                self._send({"texts": self.server.model.sample(*args)})
+        except Exception as e:
+            self._send({"error": str(e)})
+        finally:
+            self.server.pending -= 1
+            self.server.slots.release()
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ModelRequestHandler)
+        self.model = model
+        self.slots = threading.Semaphore(MAX_PENDING)
+        self.pending = 0
+
+def serve_worker(socket_path, preload=False):
+    """Run one model process answering on its own Unix socket. GPT-2 loads on first use unless preloaded."""
+    import generation
+    if preload:
+        generation.get_generator()
+    ModelServer(socket_path, generation.LocalModel()).serve_forever()
+
+def worker_paths(socket_path, workers):
+    return [f"{socket_path}.{i}" for i in range(workers)]
+
+def run_pool(socket_path=MODEL_SOCKET, workers=MODEL_WORKERS, preload=False):
+    """Start `workers` model processes and restart any that die or stop answering health checks."""
+    paths = worker_paths(socket_path, workers)
+    processes = {}
+
+    def start(path):
+        process = multiprocessing.Process(target=serve_worker, args=(path, preload), daemon=True)
+        process.started_at = time.time()
+        process.start()
+        processes[path] = process
+
+    for path in paths:
+        start(path)
+    client = ModelWorkerClient(socket_path, workers, timeout=HEALTH_INTERVAL)
+    while True:
+        time.sleep(HEALTH_INTERVAL)
+        for path in paths:
+            process = processes[path]
+            starting = time.time() - process.started_at < HEALTH_INTERVAL * 2  # may still be binding its socket
+            if process.is_alive() and (starting or client.check(path) is not None):
+                continue
+            print(f"Model worker {path} is unhealthy; restarting.")
+            process.terminate()
+            process.join()
+            start(path)
+
+# --- Web side -------------------------------------------------------------------
+
+class ModelWorkerClient(ChoiceGenerator):
+    """Model backend that forwards requests to the model worker pool over Unix sockets.
+
+    A session always goes to the same worker (so its key/value cache stays
+    warm) unless that worker is down, in which case the next one is tried.
+    """
+
+    def __init__(self, socket_path=MODEL_SOCKET, workers=MODEL_WORKERS, timeout=REQUEST_TIMEOUT):
+        self.paths = worker_paths(socket_path, workers)
+        self.timeout = timeout
+        self._params = None
+        self._next = 0
+
+    @property
+    def params(self):
+        if self._params is None:
+            self._params = self._call({"op": "params"})["params"]
+        return self._params
+
+    def sample(self, narrative, session_id=None, count=1):
+        return self._call({"op": "sample", "narrative": narrative, "session_id": session_id, "count": count},
+                          session_id)["texts"]
+
+    def stream(self, narrative, session_id=None, count=1):
+        request = {"op": "stream", "narrative": narrative, "session_id": session_id, "count": count}
+        sock, reader = self._open(request, session_id)
+        with sock, reader:
+            try:
+                for line in reader:
+                    message = self._check(json.loads(line))
+                    if message.get("done"):
+                        return
+                    yield message["text"]
+            except OSError as e:
+                raise ModelUnavailable(f"model worker stopped answering: {e}")
+        raise ModelUnavailable("model worker closed the stream early")
+
+    def health(self):
+        return [dict(self.check(path) or {"ok": False}, socket=path) for path in self.paths]
+
+    def check(self, path):
+        """Return a worker's health report, or None if it does not answer."""
+        try:
+            sock, reader = self._connect(path, {"op": "health"})
+            with sock, reader:
+                return json.loads(reader.readline())
+        except (OSError, ValueError):
+            return None
+
+    def _call(self, request, session_id=None):
+        sock, reader = self._open(request, session_id)
+        with sock, reader:
+            try:
+                line = reader.readline()
+            except OSError as e:
+                raise ModelUnavailable(f"model worker stopped answering: {e}")
+        if not line:
+            raise ModelUnavailable("model worker closed the connection")
+        return self._check(json.loads(line))
+
+    def _check(self, message):
+        if message.get("error") == "busy":
+            raise ModelBusy("model worker is at capacity")
+        if "error" in message:
+            raise ModelUnavailable(message["error"])
+        return message
+
+    def _open(self, request, session_id):
+        if session_id:
+            start = zlib.crc32(session_id.encode("utf-8")) % len(self.paths)
+        else:
+            start = self._next = (self._next + 1) % len(self.paths)
+        for path in self.paths[start:] + self.paths[:start]:
+            try:
+                return self._connect(path, request)
+            except OSError:
+                continue
+        raise ModelUnavailable("no model worker is reachable")
+
+    def _connect(self, path, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+class FakeModel(ChoiceGenerator):
+    """Deterministic in-process stand-in for the model, for tests and local development."""
+
+    params = {"model": "fake"}
+    SUBJECTS = ["The hero", "A stranger", "The old map", "A distant bell", "The guard", "A shadow"]
+    ACTIONS = ["opens the sealed door", "follows the river north", "reveals a hidden name",
+               "starts to ring", "asks for a password", "slips behind the curtain"]
+
+    def sample(self, narrative, session_id=None, count=1):
+        rng = random.Random(zlib.crc32(narrative.encode("utf-8")))
+        pairs = rng.sample([(s, a) for s in self.SUBJECTS for a in self.ACTIONS], count)
+        return [f" {subject} {action}. More happens later." for subject, action in pairs]
+
+    def health(self):
+        return [{"ok": True, "loaded": True, "pid": os.getpid()}]
+
+class LazyModel(ChoiceGenerator):
+    """Backend whose module (and its heavy imports, such as torch) is only imported on first use."""
+
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        self._model = getattr(importlib.import_module(self.module), self.name)()
+                    except Exception as e:
+                        raise ModelUnavailable(f"could not load {self.module}.{self.name}: {e}") from e
+        return self._model
+
+    @property
+    def params(self):
+        return self.model.params
+
+    def sample(self, narrative, session_id=None, count=1):
+        return self.model.sample(narrative, session_id, count)
+
+    def stream(self, narrative, session_id=None, count=1):
+        return self.model.stream(narrative, session_id, count)
+
+    def health(self):
+        if self._model is None:
+            return [{"ok": True, "loaded": False, "pid": os.getpid()}]
+        return self.model.health()
+
+class FallbackModel(ChoiceGenerator):
+    """Try a chain of backends in order, moving on when one fails or exceeds the latency budget.
+
+    Cache keys use the first backend's params; callers should check
+    `was_degraded()` before caching what a fallback produced. A call that
+    ran over budget is cancelled if it has not started, otherwise it runs
+    on in the background and its result is dropped. At most
+    `max_in_flight` calls run on each backend but the last; beyond that,
+    calls go straight to the next backend, so an overloaded backend sheds
+    work instead of building up a backlog.
+    """
+
+    def __init__(self, backends, budget=LATENCY_BUDGET_MS / 1000, max_in_flight=FALLBACK_IN_FLIGHT):
+        self.backends = backends
+        self.budget = budget or None
+        self._slots = [threading.BoundedSemaphore(max_in_flight) for _ in backends[:-1]]
+        self._executor = ThreadPoolExecutor(max(1, max_in_flight * len(self._slots)), thread_name_prefix="model-call")
+        self._local = threading.local()
+
+    @property
+    def params(self):
+        return self.backends[0].params
+
+    def sample(self, narrative, session_id=None, count=1):
+        last = len(self.backends) - 1
+        for i, backend in enumerate(self.backends):
+            self._local.degraded = i > 0
+            if i == last:
+                return backend.sample(narrative, session_id, count)
+            future = self._start(i, backend.sample, narrative, session_id, count)
+            if future is None:
+                continue
+            try:
+                return future.result(self.budget)
+            except FutureTimeout:
+                future.cancel()
+                self._fell_back(i, "timeout")
+            except ModelUnavailable:
+                self._fell_back(i, "unavailable")
+
+    def stream(self, narrative, session_id=None, count=1):
+        last = len(self.backends) - 1
+        for i, backend in enumerate(self.backends):
+            self._local.degraded = i > 0
+            if i == last:
+                yield from backend.stream(narrative, session_id, count)
+                return
+            # Only the first choice is held to the budget; once one has
+            # arrived the rest of the stream is read from the same backend.
+            items = queue.Queue()
+            cancelled = threading.Event()
+            future = self._start(i, self._pump, backend, (narrative, session_id, count), items, cancelled)
+            if future is None:
+                continue
+            try:
+                kind, value = items.get(timeout=self.budget)
+            except queue.Empty:
+                cancelled.set()
+                future.cancel()
+                self._fell_back(i, "timeout")
+                continue
+            if kind == "error" and isinstance(value, ModelUnavailable):
+                self._fell_back(i, "unavailable")
+                continue
+            try:
+                while kind == "text":
+                    yield value
+                    kind, value = items.get()
+            finally:
+                cancelled.set()
+            if kind == "error":
+                raise value
+            return
+
+    def health(self):
+        return [dict(report, backend=i) for i, backend in enumerate(self.backends) for report in backend.health()]
+
+    def was_degraded(self):
+        return getattr(self._local, "degraded", False)
+
+    def _start(self, i, fn, *args):
+        """Submit a call to backend `i` if it has a free slot, else record the fallback and return None."""
+        slot = self._slots[i]
+        if not slot.acquire(blocking=False):
+            self._fell_back(i, "busy")
+            return None
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            slot.release()
+            raise
+        future.add_done_callback(lambda _: slot.release())  # also runs when the call is cancelled
+        return future
+
+    def _pump(self, backend, args, items, cancelled):
+        try:
+            # Closing lets the backend stop generating once the consumer has gone.
+            with closing(backend.stream(*args)) as stream:
+                for text in stream:
+                    if cancelled.is_set():
+                        return
+                    items.put(("text", text))
+            items.put(("done", None))
+        except Exception as e:
+            items.put(("error", e))
+
+    def _fell_back(self, i, reason):
+        metrics.inc("story_backend_fallbacks_total", backend=i, reason=reason)
+
+# Backends by MODEL_BACKEND name; modules are imported only when selected.
+BACKENDS = {
+    "local": ("generation", "LocalModel"),
+    "worker": ("model_worker", "ModelWorkerClient"),
+    "template": ("template_model", "TemplateModel"),
+    "fake": ("model_worker", "FakeModel"),
+}
+
+def get_model_backend(name):
+    """Build the backend selected by MODEL_BACKEND: local, worker, template or fake.
+
+    A comma-separated list ("local,template") builds a FallbackModel that
+    uses the later backends when the earlier ones fail or run over
+    MODEL_LATENCY_BUDGET_MS.
+    """
+    names = [part.strip() for part in name.split(",") if part.strip()]
+    if len(names) > 1:
+        return FallbackModel([get_model_backend(part) for part in names])
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}")
+    module, cls = BACKENDS[name]
+    if module == "model_worker":
+        return globals()[cls]()
+    return LazyModel(module, cls)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the local GPT-2 model worker pool.")
+    parser.add_argument("--socket", default=MODEL_SOCKET)
+    parser.add_argument("--workers", type=int, default=MODEL_WORKERS)
+    parser.add_argument("--preload", action="store_true", help="load the model at startup instead of on first use")
+    args = parser.parse_args()
+    run_pool(args.socket, args.workers, args.preload)
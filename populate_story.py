@@ -1,6 +1,6 @@
-import sqlite3
-
-DB_PATH = "story_database.db"
+from storage import replace_story_templates
+from story_graph import STORY_DATA_PATH
+from story_import import import_stories
 
 def init_story_templates():
     """Pre-populate the database with predefined story choices based on themes."""
@@ -22,16 +22,8 @@ def init_story_templates():
         ]
     }
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("DELETE FROM story_templates")  # Clear existing templates
-    for theme, options in stories.items():
-        for option in options:
-            cursor.execute("INSERT INTO story_templates (theme, text) VALUES (?, ?)", (theme, option))
-
-    conn.commit()
-    conn.close()
+    replace_story_templates(stories)  # Clear existing templates and insert in one transaction
 
 init_story_templates()
-print("Story templates initialized.")
+import_stories(STORY_DATA_PATH)  # Only stories that changed since the last run are rewritten
+print("Story templates and stories initialized.")
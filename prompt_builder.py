@@ -0,0 +1,124 @@
+import itertools
+import re
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"[a-z']+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from had has have he her his i in is it its of on or she that the their
+    them then there they this to was were what when which who will with you your
+""".split())
+# Chosen turns are appended without punctuation, so long runs are split into
+# pieces of this many words before sentences are ranked.
+MAX_SENTENCE_WORDS = 24
+
+# `head` is the part of the narrative already folded into `summary`.
+PromptState = namedtuple("PromptState", "head summary")
+
+def split_sentences(text):
+    sentences = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        words = sentence.split()
+        sentences.extend(" ".join(words[i:i + MAX_SENTENCE_WORDS]) for i in range(0, len(words), MAX_SENTENCE_WORDS))
+    return sentences
+
+def summarize(text, budget, count_tokens):
+    """Extractive summary: the highest-scoring sentences of `text`, in order, within `budget` tokens.
+
+    Sentences score by the mean frequency of their content words in the
+    text. The first sentence, the story's premise, is always kept.
+    """
+    sentences = split_sentences(text)
+    frequency = Counter(word for word in WORD.findall(text.lower()) if word not in STOPWORDS)
+
+    def score(sentence):
+        words = [word for word in WORD.findall(sentence.lower()) if word not in STOPWORDS]
+        return sum(frequency[word] for word in words) / len(words) if words else 0.0
+
+    ranked = sorted(range(1, len(sentences)), key=lambda i: score(sentences[i]), reverse=True)
+    chosen, used = [], 0
+    for i in ([0] if sentences else []) + ranked:
+        tokens = count_tokens(sentences[i])
+        if used + tokens <= budget:
+            chosen.append(i)
+            used += tokens
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+class PromptBuilder:
+    """Fit a growing narrative into a fixed token budget.
+
+    The prompt is a summary of the older narrative (at most
+    `summary_budget` tokens) followed by the recent narrative verbatim.
+    When the verbatim part outgrows the rest of the budget, its oldest
+    text is folded into the summary until only `keep_ratio` of that space
+    is used. Between those steps each turn only appends to the previous
+    prompt, so per-session state keeps its tokenized prefix reusable and
+    the work per turn stays flat however long the story gets.
+
+    Calls without a session id (pre-generated branches, cache warming)
+    start from the stored state with the longest `head` the narrative
+    begins with, and leave it unchanged. A branch therefore shares its
+    session's summary and costs about as much as the session's own turn.
+    States such a call had to compress itself are kept, up to
+    `max_prefixes`, for the next call.
+    """
+
+    def __init__(self, get_tokenizer, budget=512, summary_budget=128, keep_ratio=0.5, max_sessions=1024,
+                 max_prefixes=256):
+        self.get_tokenizer = get_tokenizer
+        self.summary_budget = summary_budget
+        self.recent_budget = budget - summary_budget
+        self.keep_ratio = keep_ratio
+        self.max_sessions = max_sessions
+        self.max_prefixes = max_prefixes
+        self._states = OrderedDict()
+        self._prefixes = OrderedDict()  # head -> PromptState, from calls without a session
+        self._lock = threading.Lock()
+        self.compressions = 0
+
+    def build(self, narrative, session_id=None):
+        """Return the narrative as it should be given to the model."""
+        with self._lock:
+            state = self._states.get(session_id) if session_id else self._longest_prefix(narrative)
+        if state is None or not narrative.startswith(state.head):
+            state = PromptState("", "")
+
+        recent = narrative[len(state.head):]
+        offsets = self.get_tokenizer()(recent, return_offsets_mapping=True)["offset_mapping"]
+        compressed = len(offsets) > self.recent_budget
+        if compressed:
+            keep = int(self.recent_budget * self.keep_ratio)
+            cut = offsets[len(offsets) - keep][0]
+            folded = (state.summary + " " + recent[:cut]) if state.summary else recent[:cut]
+            state = PromptState(state.head + recent[:cut], summarize(folded, self.summary_budget, self.count_tokens))
+            recent = recent[cut:]
+            self.compressions += 1
+
+        with self._lock:
+            if session_id:
+                self._remember(self._states, session_id, state, self.max_sessions)
+            elif compressed:
+                self._remember(self._prefixes, state.head, state, self.max_prefixes)
+        return f"{state.summary} {recent.lstrip()}" if state.summary else recent
+
+    def _longest_prefix(self, narrative):
+        best = None
+        for state in itertools.chain(self._states.values(), self._prefixes.values()):
+            if state.head and (best is None or len(state.head) > len(best.head)) and narrative.startswith(state.head):
+                best = state
+        return best
+
+    @staticmethod
+    def _remember(states, key, state, limit):
+        states[key] = state
+        states.move_to_end(key)
+        while len(states) > limit:
+            states.popitem(last=False)
+
+    def count_tokens(self, text):
+        return len(self.get_tokenizer()(text)["input_ids"])
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._states), "prefixes": len(self._prefixes), "compressions": self.compressions}
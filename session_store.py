@@ -0,0 +1,144 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from storage import (DB_PATH, append_narrative, delete_web_session, get_narrative, load_web_session,
+                     narrative_turn, prune_web_sessions, save_web_session)
+
+PRUNE_EVERY = 100  # new sessions between sweeps of expired ones
+
+class LRUCache:
+    """Small thread-safe LRU mapping."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class ServerSession(SecureCookieSession):
+    """Session data kept on the server; only `sid` is sent to the browser."""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask sessions stored in the story database behind an in-process LRU.
+
+    The cookie holds a random session id, so nothing depends on
+    `app.secret_key` and any worker can serve any request. A session's
+    id is replaced whenever its data changes, which means a cached copy
+    can never go stale in another worker process.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_entries=4096, ttl=30 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._cache = LRUCache(max_entries)
+        self._created = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            cached = self._cache.get(sid)
+            if cached and time.time() - cached[1] < self.ttl:
+                return ServerSession(cached[0], sid)
+            stored = load_web_session(sid, self.ttl, self.db_path)
+            if stored:
+                self._cache.put(sid, (dict(stored[0]), stored[1]))
+                return ServerSession(stored[0], sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.modified:
+            return
+
+        if session.sid:
+            self._cache.pop(session.sid)
+            delete_web_session(session.sid, self.db_path)
+        if not session:
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        sid = secrets.token_urlsafe(32)
+        data = dict(session)
+        save_web_session(sid, data, self.db_path)
+        self._cache.put(sid, (data, time.time()))
+        self._created += 1
+        if self._created % PRUNE_EVERY == 0:
+            prune_web_sessions(self.ttl, self.db_path)
+        response.set_cookie(name, sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+class NarrativeCache:
+    """In-process LRU of users' narratives, backed by the segment log in the story database.
+
+    Each entry remembers the turn it was built from. A read checks the
+    stored latest turn (one primary-key lookup) and only rebuilds the
+    narrative when another worker has appended to it since.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_entries=1024):
+        self.db_path = db_path
+        self._cache = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Return the user's narrative, or None if they have none."""
+        turn = narrative_turn(user_id, self.db_path)
+        cached = self._cache.get(user_id)
+        if cached and cached[0] == turn:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        narrative = get_narrative(user_id, self.db_path)
+        if narrative is not None:
+            self._cache.put(user_id, (turn, narrative))
+        return narrative
+
+    def append(self, user_id, text):
+        """Append one turn's text to the user's narrative and return the whole narrative."""
+        cached = self._cache.get(user_id)
+        turn = append_narrative(user_id, text, self.db_path)
+        if cached and cached[0] == turn - 1:
+            narrative = cached[1] + text
+        elif turn == 0:
+            narrative = text
+        else:
+            narrative = get_narrative(user_id, self.db_path)
+        self._cache.put(user_id, (turn, narrative))
+        return narrative
+
+    def stats(self):
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+class Speculator:
+    """Pre-generate choices for the branches a user is likely to pick next.
+
+    `schedule(session_id, narratives)` queues `generate(narrative)` for each
+    offered branch on a small pool of background threads, in priority
+    order (earlier branches first, across all sessions). Once the user
+    picks, `choose` keeps that branch and cancels or drops the rest.
+
+    Speculation only uses spare capacity: workers wait while any
+    foreground generation is running (see `foreground`), at most
+    `max_queue` branches are queued, and each failed generation doubles a
+    backoff pause, up to `max_backoff` seconds.
+    """
+
+    def __init__(self, generate, workers=1, max_queue=32, max_sessions=1024, max_backoff=60.0):
+        self.generate = generate
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self.max_backoff = max_backoff
+        self._sessions = OrderedDict()  # session_id -> {narrative: Future}
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._foreground = 0
+        self._failures = 0
+        self._backoff_until = 0.0
+        self.scheduled = self.skipped = self.used = self.wasted = 0
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"speculator-{i}", daemon=True).start()
+
+    def schedule(self, session_id, narratives):
+        """Replace the session's speculative branches with `narratives`, most likely first."""
+        with self._cond:
+            previous = self._sessions.pop(session_id, {})
+            branches = {}
+            for rank, narrative in enumerate(narratives):
+                future = previous.pop(narrative, None)
+                if future is None:
+                    if time.monotonic() < self._backoff_until or self._queued() >= self.max_queue:
+                        self.skipped += 1
+                        continue
+                    if len(self._queue) > 2 * self.max_queue:
+                        self._queue = [item for item in self._queue if not item[3].cancelled()]
+                        heapq.heapify(self._queue)
+                    future = Future()
+                    heapq.heappush(self._queue, (rank, next(self._order), narrative, future))
+                    self.scheduled += 1
+                branches[narrative] = future
+            self._drop(previous.values())
+            self._sessions[session_id] = branches
+            while len(self._sessions) > self.max_sessions:
+                self._drop(self._sessions.popitem(last=False)[1].values())
+            self._cond.notify_all()
+
+    def choose(self, session_id, narrative):
+        """Keep only the branch the user picked; the others are cancelled or their results dropped."""
+        with self._cond:
+            branches = self._sessions.get(session_id)
+            if branches:
+                chosen = branches.pop(narrative, None)
+                self._drop(branches.values())
+                self._sessions[session_id] = {narrative: chosen} if chosen else {}
+
+    def ready(self, session_id, narrative):
+        """Return the branch's result if it has already finished successfully, else None.
+
+        A returned result is handed over: the branch leaves the session.
+        """
+        with self._cond:
+            branches = self._sessions.get(session_id, {})
+            future = branches.get(narrative)
+            if future and future.done() and not future.cancelled() and not future.exception():
+                del branches[narrative]
+                self.used += 1
+                return future.result()
+        return None
+
+    def result(self, session_id, narrative):
+        """Return the branch's result, waiting if it is being generated; None if it is queued or absent.
+
+        The branch leaves the session either way. One still waiting in the
+        queue is cancelled, since the caller is about to generate it in the
+        foreground anyway.
+        """
+        with self._cond:
+            future = self._sessions.get(session_id, {}).pop(narrative, None)
+        if future is None or future.cancel():
+            return None
+        try:
+            choices = future.result()
+        except Exception:
+            return None
+        with self._cond:
+            self.used += 1
+        return choices
+
+    @contextmanager
+    def foreground(self):
+        """Mark a foreground generation; speculative work does not start while any is running."""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": self._queued(),
+                "sessions": len(self._sessions),
+                "scheduled": self.scheduled,
+                "skipped": self.skipped,
+                "used": self.used,
+                "wasted": self.wasted,
+                "backoff_seconds": max(0.0, self._backoff_until - time.monotonic()),
+            }
+
+    def _queued(self):
+        return sum(1 for item in self._queue if not item[3].cancelled())
+
+    def _drop(self, futures):
+        for future in futures:
+            if not future.cancel():
+                self.wasted += 1  # already generating or generated; its result is discarded
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][3].cancelled():
+                    heapq.heappop(self._queue)
+                wait = self._backoff_until - time.monotonic()
+                if self._queue and not self._foreground and wait <= 0:
+                    return heapq.heappop(self._queue)
+                self._cond.wait(wait if wait > 0 else None)
+
+    def _run(self):
+        while True:
+            _, _, narrative, future = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = self.generate(narrative)
+            except Exception as e:
+                with self._cond:
+                    self._failures += 1
+                    self._backoff_until = time.monotonic() + min(self.max_backoff, 2 ** (self._failures - 1))
+                future.set_exception(e)
+            else:
+                with self._cond:
+                    self._failures = 0
+                future.set_result(result)
@@ -0,0 +1,558 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get("STORY_DB_PATH", "story_database.db")
+
+# Applied to every new connection. WAL lets readers proceed while a writer
+# commits; NORMAL sync is durable across application crashes in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+STATEMENT_CACHE_SIZE = 256
+# Every this many turns a user's narrative is compacted into a snapshot, so
+# rebuilding it never reads more than this many segments. 0 disables snapshots.
+SNAPSHOT_EVERY = int(os.environ.get("NARRATIVE_SNAPSHOT_EVERY", 20))
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+def get_connection(db_path=None):
+    """Return this thread's connection to the database, opening and migrating it on first use.
+
+    Connections are kept per thread (and per process, so forked workers never
+    share a handle) and reuse sqlite3's prepared statement cache across calls.
+    """
+    db_path = db_path or DB_PATH
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE)
+        try:
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            if db_path not in _migrated:
+                with _migrate_lock:
+                    if db_path not in _migrated:
+                        migrate(conn)
+                        _migrated.add(db_path)
+        except Exception:
+            conn.close()  # not cached, so the next call retries the migration
+            raise
+        _local.connections[db_path] = conn
+    return conn
+
+def close_connection(db_path=None):
+    """Close this thread's connection, if it has one."""
+    conn = getattr(_local, "connections", {}).pop(db_path or DB_PATH, None)
+    if conn:
+        conn.close()
+
+@contextmanager
+def transaction(db_path=None):
+    """Yield a connection inside a transaction that commits on success and rolls back on error."""
+    conn = get_connection(db_path)
+    with conn:
+        yield conn
+
+def query_one(sql, params=(), db_path=None):
+    return get_connection(db_path).execute(sql, params).fetchone()
+
+def query_all(sql, params=(), db_path=None):
+    return get_connection(db_path).execute(sql, params).fetchall()
+
+def execute(sql, params=(), db_path=None):
+    """Run a single write statement in its own transaction."""
+    with transaction(db_path) as conn:
+        return conn.execute(sql, params)
+
+# --- Schema -----------------------------------------------------------------
+
+def _columns(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+def _add_column(cursor, table, column, definition):
+    if column not in _columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _migration_1_tables(cursor):
+    # `stories` holds one narrative per web user; the branching stories used
+    # by the CLI live in `story_nodes`/`choices`.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE,
+            theme TEXT,
+            narrative TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            theme TEXT,
+            text TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_progress (
+            user_id TEXT PRIMARY KEY,
+            current_story_id TEXT,
+            narrative TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_nodes (
+            story_id TEXT PRIMARY KEY,
+            title TEXT,
+            prompt TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS choices (
+            choice_id TEXT PRIMARY KEY,
+            story_id TEXT,
+            choice_text TEXT,
+            outcome TEXT,
+            next_story_id TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS choice_cache (
+            key TEXT PRIMARY KEY,
+            choices TEXT,
+            created_at REAL
+        )
+    """)
+
+def _migration_2_columns(cursor):
+    # Databases created by earlier versions of app.py/alter_user_progress.py
+    # may be missing these columns.
+    _add_column(cursor, "stories", "theme", "TEXT")
+    _add_column(cursor, "user_progress", "current_story_id", "TEXT")
+    _add_column(cursor, "user_progress", "narrative", "TEXT")
+
+def _migration_3_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_choices_story_id ON choices (story_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_story_templates_theme ON story_templates (theme)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_choice_cache_created ON choice_cache (created_at)")
+
+def _migration_4_segments(cursor):
+    # Narratives are stored as an append-only log of per-turn segments instead
+    # of being rewritten whole on every turn.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS narrative_segments (
+            user_id TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (user_id, turn)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS narrative_snapshots (
+            user_id TEXT PRIMARY KEY,
+            turn INTEGER NOT NULL,
+            narrative TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS progress_segments (
+            user_id TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (user_id, turn)
+        ) WITHOUT ROWID
+    """)
+
+def _migration_5_sessions(cursor):
+    # Server-side web sessions; the cookie only carries the session id.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS web_sessions (
+            session_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_updated ON web_sessions (updated_at)")
+
+def _migration_6_story_graph_version(cursor):
+    # Bumped by triggers on every change to the branching stories, so the
+    # in-memory story graph can tell when to reload with a single-row read.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_graph_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO story_graph_version (id, version) VALUES (0, 0)")
+    _create_story_graph_triggers(cursor)
+
+def _migration_7_story_hashes(cursor):
+    # Lets the story importer skip stories whose content has not changed.
+    _add_column(cursor, "story_nodes", "content_hash", "TEXT")
+
+def _migration_8_story_index(cursor):
+    # Full-text search over every stored turn, plus turn-level analytics with
+    # running aggregates, all kept up to date by the functions that write
+    # narratives. narrative_search rows share their rowid with story_turns.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_turns (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            choice TEXT,
+            created_at REAL NOT NULL,
+            UNIQUE (source, user_id, turn)
+        )
+    """)
+    # `source` is indexed too, so filtering on it narrows the match instead of scanning it.
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS narrative_search USING fts5(text, source, tokenize = 'porter unicode61')")
+    # Each turn is its own small transaction; merging index segments in
+    # larger steps keeps those inserts cheap.
+    cursor.execute("INSERT INTO narrative_search (narrative_search, rank) VALUES ('automerge', 8)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_stats (
+            source TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            depth INTEGER NOT NULL,
+            finished INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (source, user_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_depths (
+            source TEXT NOT NULL,
+            depth INTEGER NOT NULL,
+            finished INTEGER NOT NULL,
+            stories INTEGER NOT NULL,
+            PRIMARY KEY (source, depth, finished)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS choice_counts (
+            source TEXT NOT NULL,
+            choice TEXT NOT NULL,
+            uses INTEGER NOT NULL,
+            PRIMARY KEY (source, choice)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_choice_counts_uses ON choice_counts (source, uses DESC)")
+    _rebuild_story_index(cursor.connection)
+
+def _story_graph_triggers():
+    return [(f"{table}_{event.lower()}_version", table, event)
+            for table in ("story_nodes", "choices") for event in ("INSERT", "UPDATE", "DELETE")]
+
+def _create_story_graph_triggers(cursor):
+    for name, table, event in _story_graph_triggers():
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+            BEGIN UPDATE story_graph_version SET version = version + 1; END
+        """)
+
+# Append new migrations here; each one runs once, in order, tracked by PRAGMA user_version.
+MIGRATIONS = [
+    _migration_1_tables,
+    _migration_2_columns,
+    _migration_3_indexes,
+    _migration_4_segments,
+    _migration_5_sessions,
+    _migration_6_story_graph_version,
+    _migration_7_story_hashes,
+    _migration_8_story_index,
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Bring the database up to the latest schema version.
+
+    Pending migrations run in one BEGIN IMMEDIATE transaction, and the
+    version is re-read once it holds the write lock. Other processes
+    migrating the same file wait, then find nothing left to do.
+    """
+    if schema_version(conn) >= len(MIGRATIONS):
+        return schema_version(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        version = schema_version(conn)
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {number}")
+    return schema_version(conn)
+
+# --- Web narratives -----------------------------------------------------------
+
+def save_narrative(user_id, narrative, theme=None, db_path=None):
+    """Save or update a user's current story, keeping the stored theme unless a new one is given."""
+    with transaction(db_path) as conn:
+        conn.execute("""
+            INSERT INTO stories (user_id, theme, narrative) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                narrative = excluded.narrative,
+                theme = COALESCE(excluded.theme, stories.theme)
+        """, (user_id, theme, narrative))
+        _index_turn(conn, "web", user_id, WHOLE_NARRATIVE, narrative)
+
+def _append_segment(conn, table, user_id, text):
+    """Append a segment at the user's next turn number and return that turn."""
+    conn.execute(f"""
+        INSERT INTO {table} (user_id, turn, text)
+        SELECT ?, COALESCE(MAX(turn) + 1, 0), ? FROM {table} WHERE user_id = ?
+    """, (user_id, text, user_id))
+    return conn.execute(f"SELECT MAX(turn) FROM {table} WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def _build_narrative(conn, user_id):
+    snapshot = conn.execute("SELECT turn, narrative FROM narrative_snapshots WHERE user_id = ?", (user_id,)).fetchone()
+    turn, narrative = snapshot if snapshot else (-1, "")
+    segments = conn.execute("SELECT text FROM narrative_segments WHERE user_id = ? AND turn > ? ORDER BY turn",
+                            (user_id, turn)).fetchall()
+    if not snapshot and not segments:
+        return None
+    return narrative + "".join(row[0] for row in segments)
+
+def append_narrative(user_id, text, db_path=None):
+    """Append one turn's text to a user's narrative and return the turn number.
+
+    Segments are concatenated as-is, so `text` carries its own leading separator.
+    """
+    with transaction(db_path) as conn:
+        turn = _append_segment(conn, "narrative_segments", user_id, text)
+        # Turn 0 is the user's opening prompt; every later turn is a choice.
+        _index_turn(conn, "web", user_id, turn, text, text.strip() if turn else None)
+        _set_story_depth(conn, "web", user_id, turn, finished=False)
+        if SNAPSHOT_EVERY and turn and turn % SNAPSHOT_EVERY == 0:
+            conn.execute("REPLACE INTO narrative_snapshots (user_id, turn, narrative) VALUES (?, ?, ?)",
+                         (user_id, turn, _build_narrative(conn, user_id)))
+    return turn
+
+def get_narrative(user_id, db_path=None):
+    """Rebuild the stored narrative for the given user from its latest snapshot and later segments."""
+    narrative = _build_narrative(get_connection(db_path), user_id)
+    if narrative is not None:
+        return narrative
+    # Narratives saved whole, before the segment log existed.
+    row = query_one("SELECT narrative FROM stories WHERE user_id = ?", (user_id,), db_path)
+    return row[0] if row else None
+
+def narrative_turn(user_id, db_path=None):
+    """Return the user's latest narrative turn number, or None if no segments are stored."""
+    return query_one("SELECT MAX(turn) FROM narrative_segments WHERE user_id = ?", (user_id,), db_path)[0]
+
+def get_choices_by_theme(theme, limit=3, db_path=None):
+    """Fetch predefined choices based on story theme."""
+    rows = query_all("SELECT text FROM story_templates WHERE theme = ? LIMIT ?", (theme, limit), db_path)
+    return [row[0] for row in rows]
+
+def replace_story_templates(templates, db_path=None):
+    """Replace all story templates with the given {theme: [text, ...]} mapping."""
+    with transaction(db_path) as conn:
+        conn.execute("DELETE FROM story_templates")
+        conn.executemany("INSERT INTO story_templates (theme, text) VALUES (?, ?)",
+                         [(theme, text) for theme, texts in templates.items() for text in texts])
+
+# --- Web sessions ----------------------------------------------------------------
+
+def load_web_session(session_id, max_age, db_path=None):
+    """Return (data, updated_at) for a stored session, or None if it is unknown or older than `max_age` seconds."""
+    row = query_one("SELECT data, updated_at FROM web_sessions WHERE session_id = ? AND updated_at > ?",
+                    (session_id, time.time() - max_age), db_path)
+    return (json.loads(row[0]), row[1]) if row else None
+
+def save_web_session(session_id, data, db_path=None):
+    execute("REPLACE INTO web_sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(data), time.time()), db_path)
+
+def delete_web_session(session_id, db_path=None):
+    execute("DELETE FROM web_sessions WHERE session_id = ?", (session_id,), db_path)
+
+def prune_web_sessions(max_age, db_path=None):
+    """Delete sessions older than `max_age` seconds."""
+    execute("DELETE FROM web_sessions WHERE updated_at <= ?", (time.time() - max_age,), db_path)
+
+# --- Branching stories ----------------------------------------------------------
+
+def get_story_node(story_id, db_path=None):
+    return query_one("SELECT story_id, title, prompt FROM story_nodes WHERE story_id = ?", (story_id,), db_path)
+
+def get_node_choices(story_id, db_path=None):
+    return query_all("SELECT choice_id, choice_text, outcome, next_story_id FROM choices WHERE story_id = ?",
+                     (story_id,), db_path)
+
+def story_graph_version(db_path=None):
+    """Return a counter that changes whenever story_nodes or choices are written."""
+    return query_one("SELECT version FROM story_graph_version", db_path=db_path)[0]
+
+@contextmanager
+def bulk_story_writes(rebuild_indexes=False, db_path=None):
+    """Yield a connection inside one transaction for large writes to story_nodes/choices.
+
+    The per-row version triggers are suspended and the story graph version
+    is bumped once at the end instead. With `rebuild_indexes`, the index on
+    choices.story_id is dropped for the load and rebuilt afterwards, which
+    is only worth it when most rows are new.
+    """
+    with transaction(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")  # so the DDL below rolls back with the data on error
+        for name, _, _ in _story_graph_triggers():
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        if rebuild_indexes:
+            conn.execute("DROP INDEX IF EXISTS idx_choices_story_id")
+        yield conn
+        if rebuild_indexes:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_choices_story_id ON choices (story_id)")
+        _create_story_graph_triggers(conn.cursor())
+        conn.execute("UPDATE story_graph_version SET version = version + 1")
+
+def save_user_progress(user_id, story_id, new_entries=(), reset=False, db_path=None):
+    """Record the user's current story node and append any new narrative entries.
+
+    With `reset`, the user's earlier narrative is discarded first, for
+    when they start a new story.
+    """
+    with transaction(db_path) as conn:
+        if reset:
+            _reset_progress(conn, user_id)
+        conn.execute("""
+            INSERT INTO user_progress (user_id, current_story_id) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET current_story_id = excluded.current_story_id
+        """, (user_id, story_id))
+        if new_entries:
+            _adopt_legacy_progress(conn, user_id)
+        for entry in new_entries:
+            # Reaching a story with no next node finishes it.
+            _append_progress(conn, user_id, entry, finished=story_id is None)
+
+def _append_progress(conn, user_id, entry, finished=False):
+    # Every CLI entry records one choice.
+    turn = _append_segment(conn, "progress_segments", user_id, entry)
+    _index_turn(conn, "cli", user_id, turn, entry, entry)
+    _set_story_depth(conn, "cli", user_id, turn + 1, finished)
+
+def _adopt_legacy_progress(conn, user_id):
+    """Move progress saved as a whole JSON list into the segment log, ahead of the first new entry."""
+    row = conn.execute("SELECT narrative FROM user_progress WHERE user_id = ?", (user_id,)).fetchone()
+    if not row or not row[0]:
+        return
+    has_segments = conn.execute("SELECT 1 FROM progress_segments WHERE user_id = ? LIMIT 1", (user_id,)).fetchone()
+    if not has_segments:
+        _unindex_turns(conn, "cli", user_id)
+        for entry in json.loads(row[0]):
+            _append_progress(conn, user_id, entry)
+    conn.execute("UPDATE user_progress SET narrative = NULL WHERE user_id = ?", (user_id,))
+
+def _reset_progress(conn, user_id):
+    conn.execute("DELETE FROM progress_segments WHERE user_id = ?", (user_id,))
+    conn.execute("UPDATE user_progress SET narrative = NULL WHERE user_id = ?", (user_id,))
+    _unindex_turns(conn, "cli", user_id)
+    # The previous story stays counted in story_depths; the next one gets its own stats.
+    conn.execute("DELETE FROM story_stats WHERE source = 'cli' AND user_id = ?", (user_id,))
+
+def get_user_progress(user_id, db_path=None):
+    """Return (current_story_id, narrative entries) for a user, or None if they have no progress."""
+    row = query_one("SELECT current_story_id, narrative FROM user_progress WHERE user_id = ?", (user_id,), db_path)
+    if not row:
+        return None
+    story_id, legacy_json = row
+    entries = [r[0] for r in query_all("SELECT text FROM progress_segments WHERE user_id = ? ORDER BY turn",
+                                       (user_id,), db_path)]
+    if not entries and legacy_json:
+        # Progress saved as a whole JSON list, before the segment log existed.
+        entries = json.loads(legacy_json)
+    return story_id, entries
+
+# --- Search and analytics index ----------------------------------------------------
+
+# Turn number under which narratives saved whole (save_narrative, and data
+# from before the segment logs) are indexed; they are searchable but not
+# counted in the analytics.
+WHOLE_NARRATIVE = -1
+
+def _index_turn(conn, source, user_id, turn, text, choice=None):
+    """Add one turn to story_turns and the search index, counting its choice."""
+    row = conn.execute("SELECT id FROM story_turns WHERE source = ? AND user_id = ? AND turn = ?",
+                       (source, user_id, turn)).fetchone()
+    if row:
+        # Only whole narratives are rewritten; segments are append-only.
+        conn.execute("DELETE FROM narrative_search WHERE rowid = ?", (row[0],))
+        conn.execute("UPDATE story_turns SET choice = ?, created_at = ? WHERE id = ?", (choice, time.time(), row[0]))
+        turn_id = row[0]
+    else:
+        turn_id = conn.execute("INSERT INTO story_turns (source, user_id, turn, choice, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (source, user_id, turn, choice, time.time())).lastrowid
+    conn.execute("INSERT INTO narrative_search (rowid, text, source) VALUES (?, ?, ?)", (turn_id, text, source))
+    if choice:
+        conn.execute("""
+            INSERT INTO choice_counts (source, choice, uses) VALUES (?, ?, 1)
+            ON CONFLICT(source, choice) DO UPDATE SET uses = uses + 1
+        """, (source, choice))
+
+def _set_story_depth(conn, source, user_id, depth, finished):
+    """Record a story's depth (choices made) and whether it finished, keeping story_depths in step."""
+    old = conn.execute("SELECT depth, finished FROM story_stats WHERE source = ? AND user_id = ?",
+                       (source, user_id)).fetchone()
+    if old:
+        conn.execute("UPDATE story_depths SET stories = stories - 1 WHERE source = ? AND depth = ? AND finished = ?",
+                     (source, *old))
+    conn.execute("REPLACE INTO story_stats (source, user_id, depth, finished, updated_at) VALUES (?, ?, ?, ?, ?)",
+                 (source, user_id, depth, int(finished), time.time()))
+    conn.execute("""
+        INSERT INTO story_depths (source, depth, finished, stories) VALUES (?, ?, ?, 1)
+        ON CONFLICT(source, depth, finished) DO UPDATE SET stories = stories + 1
+    """, (source, depth, int(finished)))
+
+def _unindex_turns(conn, source, user_id):
+    """Remove a story's turns from story_turns and the search index; the aggregates keep counting them."""
+    conn.execute("DELETE FROM narrative_search WHERE rowid IN "
+                 "(SELECT id FROM story_turns WHERE source = ? AND user_id = ?)", (source, user_id))
+    conn.execute("DELETE FROM story_turns WHERE source = ? AND user_id = ?", (source, user_id))
+
+def finish_story(user_id, source="web", db_path=None):
+    """Mark a story as read to its end, so it no longer counts as abandoned."""
+    with transaction(db_path) as conn:
+        row = conn.execute("SELECT depth, finished FROM story_stats WHERE source = ? AND user_id = ?",
+                           (source, user_id)).fetchone()
+        if row and not row[1]:
+            _set_story_depth(conn, source, user_id, row[0], finished=True)
+
+def rebuild_story_index(db_path=None):
+    """Rebuild the search index and analytics from the stored narratives."""
+    with transaction(db_path) as conn:
+        _rebuild_story_index(conn)
+
+def _rebuild_story_index(conn):
+    for table in ("story_turns", "narrative_search", "story_stats", "story_depths", "choice_counts"):
+        conn.execute(f"DELETE FROM {table}")
+    for user_id, turn, text in conn.execute("SELECT user_id, turn, text FROM narrative_segments ORDER BY user_id, turn"):
+        _index_turn(conn, "web", user_id, turn, text, text.strip() if turn else None)
+        _set_story_depth(conn, "web", user_id, turn, finished=False)
+    progress = conn.execute("""
+        SELECT s.user_id, s.turn, s.text, p.current_story_id IS NULL
+        FROM progress_segments s LEFT JOIN user_progress p ON p.user_id = s.user_id
+        ORDER BY s.user_id, s.turn
+    """)
+    for user_id, turn, text, finished in progress:
+        _index_turn(conn, "cli", user_id, turn, text, text)
+        _set_story_depth(conn, "cli", user_id, turn + 1, finished=bool(finished))
+    # Narratives saved whole, before the segment logs existed.
+    for user_id, narrative in conn.execute("SELECT user_id, narrative FROM stories WHERE narrative IS NOT NULL"):
+        _index_turn(conn, "web", user_id, WHOLE_NARRATIVE, narrative)
+    legacy = conn.execute("SELECT user_id, narrative FROM user_progress WHERE narrative IS NOT NULL AND narrative != '[]'")
+    for user_id, entries in legacy:
+        _index_turn(conn, "cli", user_id, WHOLE_NARRATIVE, "\n".join(json.loads(entries)))
+
+if __name__ == "__main__":
+    print(f"Schema version: {schema_version(get_connection())}")
@@ -0,0 +1,100 @@
+import argparse
+import sqlite3
+from collections import namedtuple
+
+from storage import DB_PATH, WHOLE_NARRATIVE, query_all, rebuild_story_index
+
+PAGE_SIZE = 20
+SNIPPET_TOKENS = 12
+# Larger than any rowid; the cursor for the first page of search results.
+FIRST_PAGE = 2 ** 63 - 1
+
+SearchHit = namedtuple("SearchHit", "turn_id source user_id turn snippet")
+
+def search(query, source=None, limit=PAGE_SIZE, cursor=FIRST_PAGE, db_path=None):
+    """Find stored turns matching an FTS5 query, newest first.
+
+    Returns (hits, next_cursor); pass `next_cursor` back for the next page,
+    it is None on the last one. Pages are keyed by rowid rather than an
+    offset, so every page costs the same however deep it is. A malformed
+    query raises sqlite3.OperationalError.
+    """
+    match = f"text : ({query})"
+    if source:
+        match = f'source : "{source}" AND {match}'
+    rows = query_all(f"""
+        SELECT t.id, t.source, t.user_id, t.turn, snippet(narrative_search, 0, '[', ']', '...', {SNIPPET_TOKENS})
+        FROM narrative_search JOIN story_turns t ON t.id = narrative_search.rowid
+        WHERE narrative_search MATCH ? AND narrative_search.rowid < ?
+        ORDER BY narrative_search.rowid DESC LIMIT ?
+    """, (match, cursor, limit), db_path)
+    hits = [SearchHit(*row) for row in rows]
+    return hits, (hits[-1].turn_id if len(hits) == limit else None)
+
+def popular_choices(source="web", limit=PAGE_SIZE, offset=0, db_path=None):
+    """Return [(choice, uses)], most used first."""
+    return query_all("SELECT choice, uses FROM choice_counts WHERE source = ? ORDER BY uses DESC LIMIT ? OFFSET ?",
+                     (source, limit, offset), db_path)
+
+def depth_stats(source="web", db_path=None):
+    """Summarize how far stories get, from the running per-depth counts.
+
+    Depth is the number of choices made. Stories that have not finished
+    count as abandoned at their current depth, including ones still being
+    played.
+    """
+    rows = query_all("SELECT depth, finished, stories FROM story_depths WHERE source = ? AND stories > 0 ORDER BY depth",
+                     (source,), db_path)
+    stories = sum(count for _, _, count in rows)
+    abandoned = {depth: count for depth, finished, count in rows if not finished}
+    return {
+        "stories": stories,
+        "finished": stories - sum(abandoned.values()),
+        "average_depth": sum(depth * count for depth, _, count in rows) / stories if stories else 0.0,
+        "depths": {depth: sum(count for d, _, count in rows if d == depth) for depth, _, _ in rows},
+        "abandoned_at": abandoned,
+        "most_common_abandonment": max(abandoned, key=abandoned.get) if abandoned else None,
+    }
+
+def print_hits(hits):
+    for hit in hits:
+        turn = "whole narrative" if hit.turn == WHOLE_NARRATIVE else f"turn {hit.turn}"
+        print(f"{hit.source} {hit.user_id} ({turn}): {' '.join(hit.snippet.split())}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search stored narratives and report story analytics.")
+    parser.add_argument("--db", default=DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    search_parser = commands.add_parser("search", help="full-text search, newest first (FTS5 query syntax)")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--source", choices=["web", "cli"])
+    search_parser.add_argument("--limit", type=int, default=PAGE_SIZE)
+    search_parser.add_argument("--cursor", type=int, default=FIRST_PAGE, help="next_cursor printed by the previous page")
+    stats_parser = commands.add_parser("stats", help="depth, abandonment and popular choices")
+    stats_parser.add_argument("--source", choices=["web", "cli"], default="web")
+    stats_parser.add_argument("--top", type=int, default=10)
+    stats_parser.add_argument("--offset", type=int, default=0)
+    commands.add_parser("rebuild", help="rebuild the index from the stored narratives")
+    args = parser.parse_args()
+
+    if args.command == "search":
+        try:
+            hits, next_cursor = search(args.query, args.source, args.limit, args.cursor, args.db)
+        except sqlite3.OperationalError as e:
+            print(f"Invalid search query: {e}")
+            raise SystemExit(1)
+        print_hits(hits)
+        if next_cursor is not None:
+            print(f"next_cursor: {next_cursor}")
+    elif args.command == "stats":
+        stats = depth_stats(args.source, args.db)
+        print(f"{stats['stories']} stories, {stats['finished']} finished, "
+              f"average depth {stats['average_depth']:.1f}, "
+              f"most common abandonment at depth {stats['most_common_abandonment']}")
+        print("Depths:", ", ".join(f"{depth}: {count}" for depth, count in stats["depths"].items()))
+        print("Popular choices:")
+        for choice, uses in popular_choices(args.source, args.top, args.offset, args.db):
+            print(f"  {uses:6d}  {' '.join(choice.split())}")
+    else:
+        rebuild_story_index(args.db)
+        print("Rebuilt the story index.")
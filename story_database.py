@@ -1,56 +1,20 @@
-import sqlite3
-
-DB_PATH = "story_database.db"
+import storage
+from storage import DB_PATH
 
 def init_db():
     """Initialize database with tables for user stories and predefined choices."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE,
-            theme TEXT,
-            narrative TEXT
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS story_templates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            theme TEXT,
-            text TEXT
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    return storage.migrate(storage.get_connection())
 
 init_db()
 
 def save_narrative(user_id, theme, narrative):
     """Save or update the user's current story and theme."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("REPLACE INTO stories (user_id, theme, narrative) VALUES (?, ?, ?)", (user_id, theme, narrative))
-    conn.commit()
-    conn.close()
+    storage.save_narrative(user_id, narrative, theme)
 
 def get_narrative(user_id):
     """Retrieve the user's saved story."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT narrative FROM stories WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else None
+    return storage.get_narrative(user_id)
 
 def get_choices_by_theme(theme):
     """Fetch predefined choices based on story theme."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT text FROM story_templates WHERE theme = ?", (theme,))
-    choices = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return choices[:3]  # Return up to 3 choices
+    return storage.get_choices_by_theme(theme, limit=3)  # Return up to 3 choices
@@ -0,0 +1,140 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+from storage import DB_PATH, query_all, story_graph_version
+
+STORY_DATA_PATH = "story_data.json"
+# How often the loader checks whether the stories changed; reads in between never touch the DB.
+RELOAD_CHECK_SECONDS = float(os.environ.get("STORY_GRAPH_RELOAD_SECONDS", 2))
+
+StoryNode = namedtuple("StoryNode", "story_id title prompt choices")
+# `next_node` is the position of the next node in StoryGraph.nodes, or None for an ending.
+StoryChoice = namedtuple("StoryChoice", "choice_id text outcome next_story_id next_node")
+
+class StoryGraph:
+    """Immutable in-memory graph of the branching stories.
+
+    Nodes live in a tuple and are looked up through a dict of interned
+    story ids; each node carries its choices, which point at the next node
+    by position. Problems found while building (dangling next ids, choices
+    for unknown stories, unreachable nodes) are listed in `problems`.
+    """
+
+    def __init__(self, nodes, choices):
+        nodes = [(sys.intern(str(story_id)), title, prompt) for story_id, title, prompt in nodes]
+        self.index = {story_id: i for i, (story_id, _, _) in enumerate(nodes)}
+        self.problems = []
+        adjacency = [[] for _ in nodes]
+        incoming = [0] * len(nodes)
+        for choice_id, story_id, text, outcome, next_story_id in choices:
+            source = self.index.get(str(story_id))
+            if source is None:
+                self.problems.append(f"choice {choice_id} belongs to unknown story {story_id}")
+                continue
+            next_node = None
+            if next_story_id is not None:
+                next_story_id = sys.intern(str(next_story_id))
+                next_node = self.index.get(next_story_id)
+                if next_node is None:
+                    self.problems.append(f"choice {choice_id} leads to missing story {next_story_id}")
+                else:
+                    incoming[next_node] += 1
+            adjacency[source].append(StoryChoice(choice_id, text, outcome, next_story_id, next_node))
+
+        self.nodes = tuple(StoryNode(story_id, title, prompt, tuple(adjacency[i]))
+                           for i, (story_id, title, prompt) in enumerate(nodes))
+        # Stories nothing leads to are where players start; if every node is
+        # part of a cycle, any of them will do.
+        self.starts = tuple(i for i, count in enumerate(incoming) if count == 0) or tuple(range(len(nodes)))
+        for i in sorted(set(range(len(nodes))) - self._reachable()):
+            self.problems.append(f"story {self.nodes[i].story_id} cannot be reached from any starting story")
+
+    def _reachable(self):
+        seen = set(self.starts)
+        queue = deque(self.starts)
+        while queue:
+            for choice in self.nodes[queue.popleft()].choices:
+                if choice.next_node is not None and choice.next_node not in seen:
+                    seen.add(choice.next_node)
+                    queue.append(choice.next_node)
+        return seen
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node(self, story_id):
+        """Return the StoryNode for an id, or None."""
+        i = self.index.get(story_id)
+        return self.nodes[i] if i is not None else None
+
+    def random_start(self, rng=random):
+        """Return the id of a random starting story, or None if there are no stories."""
+        return self.nodes[rng.choice(self.starts)].story_id if self.starts else None
+
+    @classmethod
+    def from_db(cls, db_path=None):
+        nodes = query_all("SELECT story_id, title, prompt FROM story_nodes ORDER BY rowid", db_path=db_path)
+        choices = query_all("SELECT choice_id, story_id, choice_text, outcome, next_story_id FROM choices ORDER BY rowid",
+                            db_path=db_path)
+        return cls(nodes, choices)
+
+    @classmethod
+    def from_json(cls, path=STORY_DATA_PATH):
+        """Build the graph from story_data.json: a list of stories, each with its choices."""
+        with open(path, "r", encoding="utf-8") as file:
+            stories = json.load(file)
+        nodes = [(story["story_id"], story.get("title", f"Story {story['story_id']}"), story["prompt"])
+                 for story in stories]
+        choices = [(choice["choice_id"], story["story_id"], choice["text"], choice["outcome"],
+                    choice.get("next_story_id"))
+                   for story in stories for choice in story.get("choices", [])]
+        return cls(nodes, choices)
+
+class StoryGraphLoader:
+    """Hand out the current StoryGraph, rebuilding it when its source changes.
+
+    Stories come from the story_nodes/choices tables, or from
+    story_data.json while those are empty. Changes are detected through
+    the story graph version the database bumps on every write to those
+    tables (and the JSON file's mtime), checked at most every
+    `check_interval` seconds.
+    """
+
+    def __init__(self, db_path=DB_PATH, story_data_path=STORY_DATA_PATH, check_interval=RELOAD_CHECK_SECONDS):
+        self.db_path = db_path
+        self.story_data_path = story_data_path
+        self.check_interval = check_interval
+        self._graph = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._graph is not None and now - self._checked_at < self.check_interval:
+            return self._graph
+        with self._lock:
+            if self._graph is None or now - self._checked_at >= self.check_interval:
+                version = self._source_version()
+                if version != self._version:
+                    self._graph = self._load(version)
+                    self._version = version
+                self._checked_at = now
+        return self._graph
+
+    def _source_version(self):
+        json_mtime = os.path.getmtime(self.story_data_path) if os.path.exists(self.story_data_path) else None
+        return story_graph_version(self.db_path), json_mtime
+
+    def _load(self, version):
+        graph = StoryGraph.from_db(self.db_path)
+        if not len(graph) and version[1] is not None:
+            graph = StoryGraph.from_json(self.story_data_path)
+        for problem in graph.problems:
+            print(f"Story graph: {problem}")
+        return graph
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import json
+import time
+
+from storage import DB_PATH, bulk_story_writes, query_one
+
+BATCH_SIZE = 2000  # stories per executemany batch
+CHUNK_SIZE = 1 << 16  # characters read at a time from a JSON array file
+MAX_REPORTED_ERRORS = 20
+
+class DatasetError(ValueError):
+    """The dataset is malformed or fails validation; nothing was imported."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        shown = errors[:MAX_REPORTED_ERRORS]
+        more = f"\n... and {len(errors) - len(shown)} more" if len(errors) > len(shown) else ""
+        super().__init__("\n".join(shown) + more)
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """Yield the objects of a top-level JSON array, reading the file a chunk at a time."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise DatasetError(["expected a JSON array of stories"])
+    pos, eof = 1, False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise DatasetError(["unterminated JSON array"])
+            buffer, pos = file.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise DatasetError([f"invalid JSON: {e}"])
+            chunk = file.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        yield item
+
+def iter_json_lines(file):
+    for line_number, line in enumerate(file, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise DatasetError([f"line {line_number}: invalid JSON: {e}"])
+
+def iter_stories(path):
+    """Stream stories from a .json array or a .jsonl file with one story per line."""
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            yield from iter_json_lines(file)
+        else:
+            yield from iter_json_array(file)
+
+def story_record(story, number):
+    """Normalize one dataset story into (story_id, title, prompt, content_hash, choices), or raise DatasetError."""
+    if not isinstance(story, dict) or "story_id" not in story or not story.get("prompt"):
+        raise DatasetError([f"story #{number}: needs a story_id and a prompt"])
+    story_id = str(story["story_id"])
+    title = story.get("title") or f"Story {story_id}"
+    choices = []
+    for choice in story.get("choices", []):
+        if not isinstance(choice, dict) or "choice_id" not in choice or not choice.get("text"):
+            raise DatasetError([f"story {story_id}: every choice needs a choice_id and text"])
+        next_story_id = choice.get("next_story_id")
+        choices.append((str(choice["choice_id"]), story_id, choice["text"], choice.get("outcome", ""),
+                        str(next_story_id) if next_story_id is not None else None))
+    content = repr((title, story["prompt"], choices))
+    content_hash = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+    return story_id, title, story["prompt"], content_hash, choices
+
+def import_stories(path, replace=False, allow_dangling=False, batch_size=BATCH_SIZE, db_path=None):
+    """Load a story dataset into story_nodes/choices and return import counts.
+
+    Stories are upserted by story_id; one whose content hash matches the
+    stored one is skipped, so re-importing a dataset only rewrites the
+    stories that changed. With `replace`, existing stories are removed
+    first. Everything happens in one transaction that is rolled back if
+    validation fails: duplicate story/choice ids, choice ids that belong
+    to a stored story the dataset does not include, or `next_story_id`s
+    that match neither the dataset nor a stored story (unless
+    `allow_dangling`).
+    """
+    counts = {"stories": 0, "written": 0, "unchanged": 0, "choices": 0}
+    seen_stories, seen_choices, linked = set(), set(), set()
+    taken = {}  # choice_id -> (stored story_id, importing story_id)
+    errors = []
+    empty = query_one("SELECT NOT EXISTS (SELECT 1 FROM story_nodes)", db_path=db_path)[0]
+
+    with bulk_story_writes(rebuild_indexes=replace or empty, db_path=db_path) as conn:
+        if replace:
+            conn.execute("DELETE FROM choices")
+            conn.execute("DELETE FROM story_nodes")
+
+        def write(batch):
+            stored = {}
+            if not (replace or empty):
+                ids = json.dumps([record[0] for record in batch])
+                stored = dict(conn.execute("SELECT story_id, content_hash FROM story_nodes "
+                                           "WHERE story_id IN (SELECT value FROM json_each(?))", (ids,)))
+            changed = [record for record in batch if stored.get(record[0]) != record[3]]
+            choices = [choice for record in changed for choice in record[4]]
+            if not (replace or empty):
+                ids = json.dumps([choice[0] for choice in choices])
+                owners = dict(conn.execute("SELECT choice_id, story_id FROM choices "
+                                           "WHERE choice_id IN (SELECT value FROM json_each(?))", (ids,)))
+                for choice_id, story_id, _, _, _ in choices:
+                    if owners.get(choice_id, story_id) != story_id:
+                        taken[choice_id] = (owners[choice_id], story_id)
+            conn.executemany("""
+                INSERT INTO story_nodes (story_id, title, prompt, content_hash) VALUES (?, ?, ?, ?)
+                ON CONFLICT(story_id) DO UPDATE SET
+                    title = excluded.title, prompt = excluded.prompt, content_hash = excluded.content_hash
+            """, [record[:4] for record in changed])
+            conn.executemany("DELETE FROM choices WHERE story_id = ?",
+                             [(record[0],) for record in changed if record[0] in stored])
+            conn.executemany("INSERT OR REPLACE INTO choices (choice_id, story_id, choice_text, outcome, next_story_id) "
+                             "VALUES (?, ?, ?, ?, ?)", choices)
+            counts["written"] += len(changed)
+            counts["unchanged"] += len(batch) - len(changed)
+            counts["choices"] += len(choices)
+
+        batch = []
+        for number, story in enumerate(iter_stories(path), start=1):
+            record = story_record(story, number)
+            story_id, choices = record[0], record[4]
+            if story_id in seen_stories:
+                errors.append(f"duplicate story_id {story_id}")
+            seen_stories.add(story_id)
+            for choice_id, _, _, _, next_story_id in choices:
+                if choice_id in seen_choices:
+                    errors.append(f"duplicate choice_id {choice_id} in story {story_id}")
+                seen_choices.add(choice_id)
+                if next_story_id is not None:
+                    linked.add(next_story_id)
+            counts["stories"] += 1
+            batch.append(record)
+            if len(batch) == batch_size:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+
+        # A choice may move between stories that are both in this import;
+        # otherwise INSERT OR REPLACE would silently take it from another story.
+        errors.extend(f"choice_id {choice_id} in story {story_id} already belongs to story {owner}"
+                      for choice_id, (owner, story_id) in sorted(taken.items()) if owner not in seen_stories)
+
+        # Links may also point at stories stored by an earlier import.
+        missing = linked - seen_stories
+        if missing and not replace:
+            stored = conn.execute("SELECT story_id FROM story_nodes WHERE story_id IN (SELECT value FROM json_each(?))",
+                                  (json.dumps(sorted(missing)),))
+            missing -= {row[0] for row in stored}
+        dangling = [f"next_story_id {story_id} does not match any story" for story_id in sorted(missing)]
+        if dangling and allow_dangling:
+            for message in dangling:
+                print(f"Warning: {message}")
+        else:
+            errors.extend(dangling)
+        if errors:
+            raise DatasetError(errors)
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a JSON or JSONL story dataset into the story database.")
+    parser.add_argument("path", help="story_data.json-style array, or .jsonl with one story per line")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--replace", action="store_true", help="remove all stored stories first")
+    parser.add_argument("--allow-dangling", action="store_true", help="warn about unknown next_story_ids instead of failing")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        counts = import_stories(args.path, args.replace, args.allow_dangling, args.batch_size, args.db)
+    except DatasetError as e:
+        print(f"Import failed, nothing was written:\n{e}")
+        raise SystemExit(1)
+    print(f"Imported {counts['stories']} stories in {time.perf_counter() - start:.1f}s: "
+          f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['choices']} choices.")
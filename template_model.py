@@ -0,0 +1,102 @@
+import json
+import os
+import random
+import re
+import threading
+import zlib
+from collections import defaultdict
+
+from model_worker import ChoiceGenerator
+from storage import DB_PATH, query_all
+
+STORY_DATA_PATH = "story_data.json"
+TOKEN = re.compile(r"[\w'’]+|[.!?,;]")
+SENTENCE_END = frozenset(".!?")
+MAX_WORDS = 20
+MIN_KEYWORD_LENGTH = 4  # shorter words are too common to say what a sentence is about
+# Cap on corpus sentences, so building the model stays fast on a large imported dataset.
+MAX_SENTENCES = 50000
+
+def corpus(db_path=DB_PATH, story_data_path=STORY_DATA_PATH):
+    """Collect the story texts to learn from: templates, stored stories and story_data.json."""
+    texts = [row[0] for row in query_all("SELECT text FROM story_templates", db_path=db_path)]
+    texts.extend(text for row in query_all(f"SELECT choice_text, outcome FROM choices LIMIT {MAX_SENTENCES}",
+                                           db_path=db_path) for text in row if text)
+    texts.extend(row[0] for row in query_all(f"SELECT prompt FROM story_nodes LIMIT {MAX_SENTENCES}", db_path=db_path))
+    if os.path.exists(story_data_path):
+        with open(story_data_path, "r", encoding="utf-8") as file:
+            for story in json.load(file):
+                texts.append(story["prompt"])
+                for choice in story.get("choices", []):
+                    texts.extend((choice["text"], choice.get("outcome", "")))
+    return list(dict.fromkeys(text for text in texts if text))[:MAX_SENTENCES]
+
+def keywords(text):
+    return frozenset(word.lower() for word in TOKEN.findall(text) if len(word) >= MIN_KEYWORD_LENGTH)
+
+class TemplateModel(ChoiceGenerator):
+    """Cheap backend: a word trigram model over the story texts, with no torch dependency.
+
+    Each continuation starts from a different sentence opening, preferring
+    openings of sentences that share a content word with the end of the
+    narrative, then follows the trigrams to the end of a sentence. The
+    random generator is seeded from the narrative, so the same narrative
+    always gets the same continuations. Fewer than `count` come back only
+    when the corpus has too few distinct ones. The model is built on first
+    use.
+    """
+
+    params = {"model": "template", "max_words": MAX_WORDS}
+
+    def __init__(self, db_path=DB_PATH, story_data_path=STORY_DATA_PATH):
+        self.db_path = db_path
+        self.story_data_path = story_data_path
+        self._trigrams = None
+        self._starts = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        with self._lock:
+            if self._trigrams is not None:
+                return
+            trigrams, starts = defaultdict(list), defaultdict(frozenset)
+            for text in corpus(self.db_path, self.story_data_path):
+                tokens = TOKEN.findall(text)
+                if tokens and tokens[-1] not in SENTENCE_END:
+                    tokens.append(".")
+                sentence_start = 0
+                for i in range(len(tokens) - 2):
+                    if i == sentence_start:
+                        starts[tokens[i], tokens[i + 1]] |= keywords(" ".join(tokens[i:]))
+                    trigrams[tokens[i], tokens[i + 1]].append(tokens[i + 2])
+                    if tokens[i + 1] in SENTENCE_END:
+                        sentence_start = i + 2
+            self._starts = sorted(starts.items())
+            self._trigrams = dict(trigrams)
+
+    def sample(self, narrative, session_id=None, count=1):
+        self._build()
+        if not self._starts:
+            return []
+        rng = random.Random(zlib.crc32(narrative.encode("utf-8")))
+        recent = keywords(narrative[-500:])
+        related = [start for start, words in self._starts if words & recent]
+        chosen = rng.sample(related, min(count, len(related)))
+        if len(chosen) < count:
+            others = [start for start, words in self._starts if not words & recent]
+            chosen += rng.sample(others, min(count - len(chosen), len(others)))
+        return list(dict.fromkeys(" " + self._sentence(rng, start) for start in chosen))
+
+    def _sentence(self, rng, start):
+        words = list(start)
+        while len(words) < MAX_WORDS and words[-1] not in SENTENCE_END:
+            following = self._trigrams.get((words[-2], words[-1]))
+            if not following:
+                break
+            words.append(rng.choice(following))
+        text = " ".join(words)
+        text = re.sub(r" ([.!?,;])", r"\1", text)
+        return text if text[-1] in SENTENCE_END else text + "."
+
+    def health(self):
+        return [{"ok": True, "loaded": self._trigrams is not None, "pid": os.getpid()}]
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from batch_scheduler import BatchScheduler
+
+class RecordingBatch:
+    """generate_batch stand-in that records each batch and can hold it until released."""
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, prompts, count):
+        self.release.wait(5)
+        self.batches.append((list(prompts), count))
+        if "fail" in prompts:
+            raise RuntimeError("model failed")
+        return [[f"{prompt}-{i}" for i in range(count)] for prompt in prompts]
+
+class TestBatchScheduler(unittest.TestCase):
+    def test_requests_within_the_window_share_a_batch(self):
+        """Ensure prompts queued within the window run as one call and get their own results."""
+        generate = RecordingBatch()
+        scheduler = BatchScheduler(generate, window=0.2, max_batch_size=8)
+        futures = [scheduler.submit(prompt, 2) for prompt in ("a", "b", "c")]
+        self.assertEqual([future.result(5) for future in futures], [["a-0", "a-1"], ["b-0", "b-1"], ["c-0", "c-1"]])
+        self.assertEqual(generate.batches, [(["a", "b", "c"], 2)])
+        self.assertEqual(scheduler.stats()["max_batch_size"], 3)
+
+    def test_max_batch_size_and_mixed_counts(self):
+        """Ensure batches are capped and only group requests asking for the same count."""
+        generate = RecordingBatch()
+        generate.release.clear()
+        scheduler = BatchScheduler(generate, window=0.05, max_batch_size=2)
+        first = scheduler.submit("first", 1)  # taken alone, then held while the rest queue up
+        while not scheduler.stats()["batches"]:
+            time.sleep(0.01)
+        futures = [scheduler.submit(prompt, count) for prompt, count in (("a", 1), ("b", 3), ("c", 1), ("d", 1))]
+        generate.release.set()
+        for future in [first] + futures:
+            future.result(5)
+        self.assertEqual(generate.batches, [(["first"], 1), (["a", "c"], 1), (["b"], 3), (["d"], 1)])
+
+    def test_errors_reach_every_request_in_the_batch(self):
+        """Ensure a failed batch fails each of its futures and the scheduler keeps serving."""
+        scheduler = BatchScheduler(RecordingBatch(), window=0.2, max_batch_size=2)
+        futures = [scheduler.submit("fail", 1), scheduler.submit("ok", 1)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(5)
+        self.assertEqual(scheduler.generate("after", 1), ["after-0"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import time
+import unittest
+from unittest import mock
+
+import storage
+from choice_cache import ChoiceCache, cache_key
+from db_test_case import DatabaseTestCase
+
+class TestChoiceCache(DatabaseTestCase):
+    def test_lru_eviction_and_promotion_from_sqlite(self):
+        """Ensure evicted entries are still served from SQLite and promoted back into memory."""
+        cache = ChoiceCache(self.db_path, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, [key])
+        self.assertEqual(cache.stats()["memory_entries"], 2)
+        self.assertEqual(cache.get("a"), ["a"])
+        self.assertEqual(cache.get("a"), ["a"])
+        self.assertEqual(cache.get("b"), ["b"])
+        self.assertEqual(cache.stats(), {"memory_entries": 2, "memory_hits": 1, "db_hits": 2, "misses": 0})
+
+    def test_expired_entries_are_misses(self):
+        """Ensure entries older than the TTL miss in both tiers."""
+        cache = ChoiceCache(self.db_path, ttl=0.05)
+        cache.put("a", ["a"])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(ChoiceCache(self.db_path, ttl=0.05).get("a"))
+
+    def test_prune_trims_the_sqlite_tier(self):
+        """Ensure pruning drops expired rows and keeps only the newest max_db_entries."""
+        storage.execute("INSERT INTO choice_cache (key, choices, created_at) VALUES ('old', '[]', 0)",
+                        db_path=self.db_path)
+        cache = ChoiceCache(self.db_path, max_db_entries=3, ttl=3600)
+        with mock.patch("choice_cache.PRUNE_EVERY", 5):
+            for i in range(5):
+                cache.put(f"k{i}", [str(i)])
+        keys = [row[0] for row in storage.query_all("SELECT key FROM choice_cache ORDER BY created_at",
+                                                    db_path=self.db_path)]
+        self.assertEqual(keys, ["k2", "k3", "k4"])
+
+    def test_key_ignores_whitespace_but_not_params(self):
+        """Ensure keys normalize whitespace and change with the generation parameters."""
+        self.assertEqual(cache_key("A  door\n creaks.", {"model": "x"}), cache_key("A door creaks.", {"model": "x"}))
+        self.assertNotEqual(cache_key("A door creaks.", {"model": "x"}), cache_key("A door creaks.", {"model": "y"}))
+
+if __name__ == "__main__":
+    unittest.main()
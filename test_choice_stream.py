@@ -0,0 +1,93 @@
+import unittest
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, StoppingCriteriaList
+
+from choice_stream import BatchStreamer, ChoiceStreamer, StopWhenFinished
+
+class StubTokenizer:
+    """Tokenizer stand-in with a handful of single-word tokens; 0 is end-of-text."""
+
+    eos_token_id = 0
+    vocab = {1: " The", 2: " door", 3: " opens", 4: ".", 5: " Run"}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(self.vocab[i] for i in ids if i != self.eos_token_id)
+
+def drain(streamer):
+    texts = []
+    while not streamer.queue.empty():
+        texts.append(streamer.queue.get())
+    return texts
+
+class TestChoiceStreamer(unittest.TestCase):
+    def test_each_row_is_yielded_once_its_sentence_ends(self):
+        """Ensure rows are handed over in the order they finish, each decoded on its own."""
+        streamer = ChoiceStreamer(StubTokenizer())
+        streamer.put(torch.ones(3, 2, dtype=torch.long))  # the prompt ids are skipped
+        streamer.put(torch.tensor([1, 5, 1]))
+        self.assertTrue(streamer.queue.empty())
+        streamer.put(torch.tensor([2, 4, 0]))
+        self.assertEqual(drain(streamer), [" Run.", " The"])
+        streamer.put(torch.tensor([3, 1, 1]))  # finished rows ignore further tokens
+        self.assertTrue(streamer.queue.empty())
+        self.assertFalse(streamer.finished)
+        streamer.end()
+        self.assertEqual(drain(streamer), [" The door opens", None])
+        self.assertTrue(streamer.finished)
+        streamer.end()
+        self.assertTrue(streamer.queue.empty())
+
+    def test_stop_when_finished(self):
+        """Ensure the stopping criterion fires once every row is out, or once the consumer cancels."""
+        streamer = ChoiceStreamer(StubTokenizer())
+        stop = StopWhenFinished(streamer)
+        self.assertFalse(stop(None, None))
+        streamer.put(torch.ones(2, 1, dtype=torch.long))
+        streamer.put(torch.tensor([4, 1]))
+        self.assertFalse(stop(None, None))
+        streamer.put(torch.tensor([1, 0]))
+        self.assertTrue(stop(None, None))
+
+        cancelled = ChoiceStreamer(StubTokenizer())
+        cancelled.cancelled = True
+        self.assertTrue(StopWhenFinished(cancelled)(None, None))
+
+    def test_generate_stops_once_every_row_is_streamed(self):
+        """Ensure a real generate call streams every row and stops early instead of running to max_new_tokens."""
+        class SentencePerToken(StubTokenizer):
+            def decode(self, ids, skip_special_tokens=False):
+                return "".join("." for i in ids if i != self.eos_token_id)
+
+        torch.manual_seed(0)
+        model = GPT2LMHeadModel(GPT2Config(vocab_size=16, n_positions=64, n_embd=16, n_layer=1, n_head=2)).eval()
+        streamer = ChoiceStreamer(SentencePerToken())
+        with torch.no_grad():
+            output = model.generate(torch.ones(4, 3, dtype=torch.long), do_sample=True, max_new_tokens=20,
+                                    pad_token_id=0, streamer=streamer,
+                                    stopping_criteria=StoppingCriteriaList([StopWhenFinished(streamer)]))
+        self.assertEqual(output.shape[1], 4)
+        texts = drain(streamer)
+        self.assertEqual((len(texts), texts[-1]), (5, None))
+
+class TestBatchStreamer(unittest.TestCase):
+    def test_rows_go_to_their_own_streamer(self):
+        """Ensure each prompt's streamer gets only its rows and the batch stops only when all are streamed."""
+        first, second = ChoiceStreamer(StubTokenizer()), ChoiceStreamer(StubTokenizer())
+        batch = BatchStreamer([first, None, second], count=2)
+        batch.put(torch.ones(6, 3, dtype=torch.long))  # the prompt ids
+        batch.put(torch.tensor([1, 5, 2, 2, 5, 1]))
+        batch.put(torch.tensor([4, 4, 4, 4, 0, 2]))
+        self.assertEqual(drain(first), [" The.", " Run."])
+        self.assertEqual(drain(second), [" Run"])
+        self.assertFalse(batch.finished)
+        batch.put(torch.tensor([0, 0, 0, 0, 0, 4]))
+        self.assertEqual(drain(second), [" The door."])
+        self.assertTrue(first.finished and second.finished)
+        self.assertFalse(batch.finished)  # the unstreamed prompt still needs its full continuations
+        self.assertTrue(BatchStreamer([first, second], count=2).finished)
+        batch.end()
+        self.assertEqual((drain(first), drain(second)), ([None], [None]))
+
+if __name__ == "__main__":
+    unittest.main()
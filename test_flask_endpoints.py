@@ -1,11 +1,38 @@
+import os
+import tempfile
 import unittest
 import json
-from app import app
+from concurrent.futures import wait
+from unittest import mock
+
+os.environ.setdefault("MODEL_BACKEND", "fake")  # keep GPT-2 out of the test run
+
+# Keep the tracked story_database.db out of the test run too. storage reads
+# STORY_DB_PATH on import, which an earlier test module may already have done.
+_tmp = tempfile.TemporaryDirectory()
+os.environ["STORY_DB_PATH"] = os.path.join(_tmp.name, "test.db")
+import storage
+_default_db_path, storage.DB_PATH = storage.DB_PATH, os.environ["STORY_DB_PATH"]
+
+import app as story_app
+from app import app, generate_choices
+from model_worker import FakeModel
+
+def tearDownModule():
+    storage.close_connection(os.environ["STORY_DB_PATH"])
+    storage.DB_PATH = _default_db_path
+    _tmp.cleanup()
 
 class TestFlaskAPI(unittest.TestCase):
     def setUp(self):
         self.client = app.test_client()
 
+    def choice_sources(self):
+        """Return story_choice_requests_total by source, as exported on /metrics."""
+        lines = self.client.get("/metrics").data.decode("utf-8").splitlines()
+        prefix = 'story_choice_requests_total{source="'
+        return {line[len(prefix):].split('"')[0]: float(line.split()[-1]) for line in lines if line.startswith(prefix)}
+
     def test_story_generation(self):
         """Ensure that a user can get valid story choices."""
         response = self.client.post("/", data={"user_prompt": "A detective finds a hidden letter."})
@@ -14,5 +41,89 @@ class TestFlaskAPI(unittest.TestCase):
         self.assertIn("Your Story So Far", data)  # Narrative should be displayed
         self.assertIn("choice", data.lower())  # Choices should be present
 
+    def test_choices_stream(self):
+        """Ensure that choices for the current story arrive as Server-Sent Events."""
+        self.client.post("/", data={"user_prompt": "A detective finds a hidden letter."})
+        response = self.client.get("/choices/stream")
+        self.assertEqual(response.mimetype, "text/event-stream")
+        data = response.data.decode("utf-8")
+        self.assertEqual(data.count("event: choice"), 3)
+        self.assertTrue(data.endswith("event: done\ndata: {}\n\n"))
+
+    def test_session_cookie_holds_only_id(self):
+        """Ensure the narrative stays on the server and the cookie does not grow with it."""
+        self.client.post("/", data={"user_prompt": "A detective finds a hidden letter."})
+        cookie = self.client.get_cookie("session").value
+        for _ in range(3):
+            response = self.client.post("/story", data={"choice": "The detective reads the letter aloud"})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get_cookie("session").value, cookie)
+        self.assertLess(len(cookie), 64)
+        ending = self.client.get("/ending").data.decode("utf-8")
+        self.assertEqual(ending.count("The detective reads the letter aloud"), 3)
+
+    def test_metrics(self):
+        """Ensure request and stage timings are exported after a story turn."""
+        self.client.post("/", data={"user_prompt": "A detective finds a hidden letter."})
+        self.client.get("/choices/stream").close()
+        data = self.client.get("/metrics").data.decode("utf-8")
+        self.assertIn('story_requests_total{endpoint="index",status="200"}', data)
+        self.assertIn('story_stage_seconds_count{stage="save_narrative"}', data)
+        self.assertIn('story_choice_requests_total{source=', data)
+        self.assertIn("story_model_ok", data)
+
+    def test_inline_choices_are_counted(self):
+        """Ensure choices rendered straight into the page count towards their source."""
+        prompt = "A lighthouse keeper hears a knock at midnight."
+        before = self.choice_sources()
+        self.client.post("/", data={"user_prompt": prompt})
+        self.client.get("/choices/stream").data
+        page = app.test_client().post("/", data={"user_prompt": prompt}).data.decode("utf-8")
+        self.assertNotIn("/choices/stream", page)  # served from the cache, not streamed
+        after = self.choice_sources()
+        self.assertEqual(after.get("cache", 0) - before.get("cache", 0), 1)
+        self.assertEqual(after.get("model", 0) - before.get("model", 0), 1)
+
+    @unittest.skipUnless(story_app.speculator, "pre-generation is disabled")
+    def test_picked_branch_is_served_from_pregeneration(self):
+        """Ensure the branch the user picks is used, and only the others count as wasted."""
+        speculator = story_app.speculator
+        self.client.post("/", data={"user_prompt": "A sailor finds a map in a bottle."})
+        events = self.client.get("/choices/stream").data.decode("utf-8")
+        choices = [json.loads(line[len("data: "):]) for line in events.splitlines()
+                   if line.startswith("data: ") and line != "data: {}"]
+        with self.client.session_transaction() as sess:
+            user_id = sess["user_id"]
+        wait(list(speculator._sessions[user_id].values()), timeout=5)
+
+        before = speculator.stats()
+        page = self.client.post("/story", data={"choice": choices[0]}).data.decode("utf-8")
+        after = speculator.stats()
+        self.assertNotIn("/choices/stream", page)
+        self.assertEqual((after["used"] - before["used"], after["wasted"] - before["wasted"]), (1, 2))
+
+    def test_backend_errors_fall_back(self):
+        """Ensure a backend that raises still gets the page and the stream their fallback choices."""
+        class BrokenModel(FakeModel):
+            params = {"model": "broken"}
+
+            def sample(self, narrative, session_id=None, count=1):
+                raise OSError("model files are missing")
+
+        with mock.patch.object(story_app, "model", BrokenModel()), mock.patch.object(story_app, "speculator", None):
+            self.assertEqual(generate_choices("A clock strikes thirteen."), story_app.FALLBACK_CHOICES)
+            self.client.post("/", data={"user_prompt": "A clock strikes thirteen."})
+            response = self.client.get("/choices/stream")
+            data = response.data.decode("utf-8")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data.count("event: choice"), 3)
+            self.assertTrue(data.endswith("event: done\ndata: {}\n\n"))
+
+    def test_generate_choices_unique(self):
+        """Ensure that three distinct choices come back for a narrative."""
+        choices = generate_choices("A detective finds a hidden letter.")
+        self.assertEqual(len(choices), 3)
+        self.assertEqual(len(set(choices)), 3)
+
 if __name__ == "__main__":
     unittest.main()
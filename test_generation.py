@@ -0,0 +1,39 @@
+import copy
+import unittest
+from unittest import mock
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+from transformers.pytorch_utils import Conv1D
+
+from generation import LocalModel, conv1d_to_linear
+from model_worker import FakeModel, FallbackModel, ModelUnavailable
+
+class TestConv1dToLinear(unittest.TestCase):
+    def test_linear_layers_match_conv1d(self):
+        """Ensure the converted model has no Conv1D left and gives the same logits as the original."""
+        torch.manual_seed(0)
+        model = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=16, n_embd=16, n_layer=2, n_head=2)).eval()
+        converted = conv1d_to_linear(copy.deepcopy(model))
+        self.assertFalse(any(isinstance(module, Conv1D) for module in converted.modules()))
+        self.assertEqual(sum(isinstance(module, torch.nn.Linear) for module in converted.modules()), 2 * 4 + 1)
+        input_ids = torch.randint(0, 32, (2, 8))
+        with torch.no_grad():
+            torch.testing.assert_close(converted(input_ids).logits, model(input_ids).logits)
+
+class TestLocalModel(unittest.TestCase):
+    def test_load_failures_hand_over_to_the_next_backend(self):
+        """Ensure a model that cannot load raises ModelUnavailable and a fallback chain moves on."""
+        with mock.patch("generation.get_generator", side_effect=OSError("no model files")):
+            with self.assertRaises(ModelUnavailable):
+                LocalModel().sample("A door creaks.")
+            with self.assertRaises(ModelUnavailable):
+                list(LocalModel().stream("A door creaks."))
+            model = FallbackModel([LocalModel(), FakeModel()])
+            expected = FakeModel().sample("A door creaks.", count=2)
+            self.assertEqual(model.sample("A door creaks.", count=2), expected)
+            self.assertEqual(list(model.stream("A door creaks.", count=2)), expected)
+            self.assertTrue(model.was_degraded())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import time
+import unittest
+
+from kv_cache import SessionKVCache, SessionState
+
+def state(text, size):
+    return SessionState(text, [], None, size)
+
+class TestSessionKVCache(unittest.TestCase):
+    def test_evicts_least_recently_used_over_the_byte_cap(self):
+        """Ensure the total size stays under the cap by dropping the least recently used sessions."""
+        cache = SessionKVCache(max_bytes=100)
+        cache.put("a", state("a", 40))
+        cache.put("b", state("b", 40))
+        cache.get("a")
+        cache.put("c", state("c", 40))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a").text, cache.get("c").text), ("a", "c"))
+        cache.put("a", state("a2", 50))  # replacing an entry releases its old size
+        self.assertEqual(cache.stats()["bytes"], 90)
+        cache.put("huge", state("huge", 101))
+        self.assertIsNone(cache.get("huge"))
+
+    def test_entries_expire_after_ttl(self):
+        """Ensure sessions untouched for longer than the TTL are dropped."""
+        cache = SessionKVCache(max_bytes=100, ttl=0.05)
+        cache.put("a", state("a", 10))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats(), {"sessions": 0, "bytes": 0, "hits": 0, "misses": 1})
+
+if __name__ == "__main__":
+    unittest.main()
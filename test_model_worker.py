@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from model_worker import (FakeModel, FallbackModel, LazyModel, ModelBusy, ModelServer, ModelUnavailable,
+                          ModelWorkerClient, get_model_backend)
+
+class TestModelWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp.name, "model.sock")
+        self.server = ModelServer(f"{self.socket_path}.0", FakeModel())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = ModelWorkerClient(self.socket_path, workers=1, timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_sample_and_stream_match_the_model(self):
+        """Ensure requests over the socket return what the model produced."""
+        expected = FakeModel().sample("A door creaks.", count=4)
+        self.assertEqual(self.client.sample("A door creaks.", "session", 4), expected)
+        self.assertEqual(list(self.client.stream("A door creaks.", "session", 4)), expected)
+        self.assertEqual(self.client.params, FakeModel.params)
+
+    def test_health_and_backpressure(self):
+        """Ensure health checks answer and a full worker refuses new work."""
+        self.assertTrue(self.client.health()[0]["ok"])
+        for _ in range(self.server.slots._value):
+            self.server.slots.acquire()
+        with self.assertRaises(ModelBusy):
+            self.client.sample("A door creaks.")
+
+    def test_unreachable_pool(self):
+        """Ensure a missing worker surfaces as ModelUnavailable."""
+        client = ModelWorkerClient(os.path.join(self.tmp.name, "missing.sock"), workers=2, timeout=1)
+        with self.assertRaises(ModelUnavailable):
+            client.sample("A door creaks.")
+
+class SlowModel(FakeModel):
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+
+    def sample(self, narrative, session_id=None, count=1):
+        self.calls.append(narrative)
+        time.sleep(self.delay)
+        return ["Slow."] * count
+
+class TestFallbackModel(unittest.TestCase):
+    def test_falls_back_over_budget(self):
+        """Ensure a backend that misses the latency budget is replaced by the next one."""
+        model = FallbackModel([SlowModel(1), FakeModel()], budget=0.05)
+        expected = FakeModel().sample("A door creaks.", count=2)
+        self.assertEqual(model.sample("A door creaks.", count=2), expected)
+        self.assertTrue(model.was_degraded())
+        self.assertEqual(list(model.stream("A door creaks.", count=2)), expected)
+        self.assertEqual(model.params, FakeModel.params)
+
+        fast = FallbackModel([SlowModel(0), FakeModel()], budget=1)
+        self.assertEqual(list(fast.stream("A door creaks.", count=2)), ["Slow.", "Slow."])
+        self.assertFalse(fast.was_degraded())
+
+    def test_in_flight_calls_are_capped(self):
+        """Ensure calls beyond the in-flight cap skip a stalled backend instead of queueing behind it."""
+        slow = SlowModel(0.5)
+        model = FallbackModel([slow, FakeModel()], budget=0.05, max_in_flight=2)
+        with ThreadPoolExecutor(40) as pool:
+            results = list(pool.map(lambda i: model.sample(f"Door {i}."), range(40)))
+        self.assertEqual(results, [FakeModel().sample(f"Door {i}.") for i in range(40)])
+        self.assertLessEqual(len(slow.calls), 2)
+
+    def test_falls_back_when_unavailable(self):
+        """Ensure an unavailable backend is skipped."""
+        model = get_model_backend("worker,fake")
+        model.backends[0] = ModelWorkerClient("/nonexistent/model.sock", workers=1, timeout=1)
+        self.assertEqual(model.sample("A door creaks."), FakeModel().sample("A door creaks."))
+        self.assertTrue(model.was_degraded())
+
+    def test_falls_back_when_a_backend_cannot_load(self):
+        """Ensure a backend whose module fails to import is skipped."""
+        model = FallbackModel([LazyModel("no_such_backend_module", "Model"), FakeModel()])
+        self.assertEqual(model.sample("A door creaks."), FakeModel().sample("A door creaks."))
+        self.assertEqual(list(model.stream("A door creaks.")), FakeModel().sample("A door creaks."))
+        self.assertTrue(model.was_degraded())
+
+    def test_backends_are_imported_lazily(self):
+        """Ensure selecting the local backend does not load it."""
+        model = get_model_backend("local")
+        self.assertIsInstance(model, LazyModel)
+        self.assertFalse(model.health()[0]["loaded"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import re
+import unittest
+
+from prompt_builder import PromptBuilder, summarize
+
+class WordTokenizer:
+    """Stand-in tokenizer with one token per word, enough to exercise the budget logic."""
+
+    def __call__(self, text, return_offsets_mapping=False):
+        offsets = [match.span() for match in re.finditer(r"\s*\S+", text)]
+        encoding = {"input_ids": list(range(len(offsets)))}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = offsets
+        return encoding
+
+def count_words(text):
+    return len(text.split())
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_summary_keeps_premise_within_budget(self):
+        """Ensure the summary starts with the premise and respects its token budget."""
+        text = "A wizard finds a book. The wizard opens the book. Rain falls. The book shows the wizard a map."
+        summary = summarize(text, 12, count_words)
+        self.assertTrue(summary.startswith("A wizard finds a book."))
+        self.assertLessEqual(count_words(summary), 12)
+
+    def test_prompt_stays_within_budget_and_extends_between_compressions(self):
+        """Ensure long narratives are compressed and consecutive turns only append to the prompt."""
+        builder = PromptBuilder(WordTokenizer, budget=40, summary_budget=10)
+        narrative = "A wizard finds a book."
+        previous = builder.build(narrative, "user")
+        for turn in range(30):
+            compressions = builder.compressions
+            narrative += f" Turn {turn} the wizard walks on."
+            prompt = builder.build(narrative, "user")
+            self.assertLessEqual(count_words(prompt), 40)
+            self.assertTrue(prompt.startswith("A wizard finds a book."))
+            if builder.compressions == compressions:
+                self.assertTrue(prompt.startswith(previous))
+            previous = prompt
+        self.assertGreater(builder.compressions, 0)
+        self.assertTrue(prompt.endswith("Turn 29 the wizard walks on."))
+
+    def test_branches_reuse_the_session_state_without_changing_it(self):
+        """Ensure prompts built without a session share the session's summary and only tokenize recent text."""
+        seen = []
+
+        class RecordingTokenizer(WordTokenizer):
+            def __call__(self, text, return_offsets_mapping=False):
+                seen.append(text)
+                return super().__call__(text, return_offsets_mapping)
+
+        builder = PromptBuilder(RecordingTokenizer, budget=40, summary_budget=10)
+        narrative = "A wizard finds a book."
+        for turn in range(30):
+            narrative += f" Turn {turn} the wizard walks on."
+            prompt = builder.build(narrative, "user")
+        state = builder._states["user"]
+        seen.clear()
+        branch = builder.build(narrative + " Open the door.", None)
+        self.assertEqual(branch, prompt + " Open the door.")
+        self.assertLess(max(len(text) for text in seen), len(narrative) - len(state.head) + 20)
+        self.assertIs(builder._states["user"], state)
+
+        # Without any stored state the first call compresses; later ones start from its result.
+        fresh = PromptBuilder(WordTokenizer, budget=40, summary_budget=10)
+        first = fresh.build(narrative, None)
+        self.assertEqual(fresh.build(narrative + " Open the door.", None), first + " Open the door.")
+        self.assertEqual(fresh.stats()["prefixes"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+
+from speculative import Speculator
+
+class TestSpeculator(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.running = threading.Event()
+        self.started = []
+
+    def generate(self, narrative):
+        self.started.append(narrative)
+        self.running.set()
+        self.release.wait(5)
+        if narrative == "fail":
+            raise RuntimeError("model is down")
+        return [narrative + " choice"]
+
+    def test_chosen_branch_is_kept_and_others_cancelled(self):
+        """Ensure picking a branch cancels the queued siblings and waits for the running one."""
+        speculator = Speculator(self.generate, workers=1)
+        speculator.schedule("user", ["a", "b", "c"])
+        self.assertTrue(self.running.wait(5))
+        speculator.choose("user", "a")
+        self.release.set()
+        self.assertEqual(speculator.result("user", "a"), ["a choice"])
+        self.assertIsNone(speculator.result("user", "b"))
+        self.assertEqual(self.started, ["a"])
+
+    def test_waits_for_foreground_work(self):
+        """Ensure speculative work does not start while a foreground generation runs."""
+        speculator = Speculator(self.generate, workers=1)
+        self.release.set()
+        with speculator.foreground():
+            speculator.schedule("user", ["a"])
+            self.assertFalse(self.running.wait(0.2))
+        self.assertTrue(self.running.wait(5))
+        self.assertEqual(speculator.result("user", "a"), ["a choice"])
+
+    def test_backs_off_after_failures(self):
+        """Ensure a failed generation pauses scheduling of new branches."""
+        speculator = Speculator(self.generate, workers=1)
+        self.release.set()
+        speculator.schedule("user", ["fail"])
+        self.assertTrue(self.running.wait(5))
+        self.assertIsNone(speculator.result("user", "fail"))
+        speculator.schedule("other", ["a"])
+        self.assertEqual(speculator.stats()["skipped"], 1)
+
+    def test_consumed_branch_is_not_counted_as_wasted(self):
+        """Ensure taking a branch's result removes it, so only the dropped siblings count as wasted."""
+        speculator = Speculator(self.generate, workers=1)
+        self.release.set()
+        speculator.schedule("user", ["a", "b", "c"])
+        while speculator.stats()["queued"]:
+            time.sleep(0.01)
+        speculator.choose("user", "a")
+        self.assertEqual(speculator.ready("user", "a"), ["a choice"])
+        self.assertIsNone(speculator.ready("user", "a"))
+        speculator.schedule("user", ["a x", "a y"])
+        stats = speculator.stats()
+        self.assertEqual((stats["used"], stats["wasted"]), (1, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+
+import storage
+from db_test_case import DatabaseTestCase
+
+class TestStorage(DatabaseTestCase):
+    def test_migrations_reach_latest_version(self):
+        """Ensure a fresh database is migrated to the newest schema."""
+        conn = storage.get_connection(self.db_path)
+        self.assertEqual(storage.schema_version(conn), len(storage.MIGRATIONS))
+
+    def test_concurrent_migrations(self):
+        """Ensure connections migrating an old database at the same time do not trip over each other."""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE stories (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT UNIQUE, narrative TEXT)")
+        conn.execute("CREATE TABLE user_progress (user_id TEXT PRIMARY KEY, narrative TEXT)")
+        conn.commit()
+        conn.close()
+        barrier = threading.Barrier(6)
+        errors = []
+
+        def migrate():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            barrier.wait()
+            try:
+                storage.migrate(conn)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=migrate) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(storage.schema_version(storage.get_connection(self.db_path)), len(storage.MIGRATIONS))
+
+    def test_failed_migration_is_retried(self):
+        """Ensure a connection whose migration failed is not kept, so the next call migrates again."""
+        attempts = []
+
+        def flaky(cursor):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError("disk I/O error")
+            cursor.execute("CREATE TABLE flaky (id INTEGER)")
+
+        with mock.patch.object(storage, "MIGRATIONS", storage.MIGRATIONS + [flaky]):
+            with self.assertRaises(sqlite3.OperationalError):
+                storage.get_connection(self.db_path)
+            conn = storage.get_connection(self.db_path)
+            self.assertEqual(storage.schema_version(conn), len(storage.MIGRATIONS))
+        self.assertEqual(len(attempts), 2)
+
+    def test_narrative_is_rebuilt_from_segments(self):
+        """Ensure appended turns (and snapshots) rebuild the full narrative."""
+        storage.append_narrative("user", "Once upon a time.", db_path=self.db_path)
+        for i in range(storage.SNAPSHOT_EVERY + 2):
+            storage.append_narrative("user", f" Turn {i}.", db_path=self.db_path)
+        expected = "Once upon a time." + "".join(f" Turn {i}." for i in range(storage.SNAPSHOT_EVERY + 2))
+        self.assertEqual(storage.get_narrative("user", db_path=self.db_path), expected)
+        self.assertIsNone(storage.get_narrative("nobody", db_path=self.db_path))
+
+    def test_user_progress_appends_entries(self):
+        """Ensure progress keeps the latest story node and every appended entry."""
+        storage.save_user_progress("user", "1", db_path=self.db_path)
+        storage.save_user_progress("user", "2", ["first"], db_path=self.db_path)
+        storage.save_user_progress("user", None, ["second"], db_path=self.db_path)
+        self.assertEqual(storage.get_user_progress("user", db_path=self.db_path), (None, ["first", "second"]))
+
+    def test_legacy_progress_is_kept_when_appending(self):
+        """Ensure progress saved as a JSON list survives the user's next choice."""
+        storage.get_connection(self.db_path)
+        storage.execute("INSERT INTO user_progress (user_id, current_story_id, narrative) VALUES ('user', '2', ?)",
+                        ('["Story: A -> a"]',), db_path=self.db_path)
+        self.assertEqual(storage.get_user_progress("user", db_path=self.db_path), ("2", ["Story: A -> a"]))
+        storage.save_user_progress("user", "3", ["Story: B -> b"], db_path=self.db_path)
+        self.assertEqual(storage.get_user_progress("user", db_path=self.db_path),
+                         ("3", ["Story: A -> a", "Story: B -> b"]))
+        self.assertIsNone(storage.query_one("SELECT narrative FROM user_progress", db_path=self.db_path)[0])
+
+    def test_reset_starts_a_new_narrative(self):
+        """Ensure starting a new story drops the finished one's entries and per-story stats."""
+        storage.save_user_progress("user", "1", db_path=self.db_path)
+        storage.save_user_progress("user", None, ["first story end"], db_path=self.db_path)
+        storage.save_user_progress("user", "5", reset=True, db_path=self.db_path)
+        storage.save_user_progress("user", "6", ["second story entry"], db_path=self.db_path)
+        self.assertEqual(storage.get_user_progress("user", db_path=self.db_path), ("6", ["second story entry"]))
+        depths = storage.query_all("SELECT depth, finished, stories FROM story_depths WHERE source = 'cli' "
+                                   "AND stories > 0 ORDER BY finished", db_path=self.db_path)
+        self.assertEqual(depths, [(1, 0, 1), (1, 1, 1)])
+
+if __name__ == "__main__":
+    unittest.main()
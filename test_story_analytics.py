@@ -0,0 +1,47 @@
+import unittest
+
+import storage
+from db_test_case import DatabaseTestCase
+from story_analytics import depth_stats, popular_choices, search
+
+class TestStoryAnalytics(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for user_id, turns in (("a", ["A dragon sleeps.", " Wake the dragon", " Run away"]),
+                               ("b", ["A quiet harbour.", " Run away"]),
+                               ("c", ["The dragons are dreaming."])):
+            for text in turns:
+                storage.append_narrative(user_id, text, db_path=self.db_path)
+
+    def test_search_pages_newest_first(self):
+        """Ensure matching turns come back newest first, page by page."""
+        hits, cursor = search("dragon", limit=2, db_path=self.db_path)
+        self.assertEqual([(hit.user_id, hit.turn) for hit in hits], [("c", 0), ("a", 1)])
+        self.assertEqual(hits[0].snippet, "The [dragons] are dreaming.")
+        hits, cursor = search("dragon", limit=2, cursor=cursor, db_path=self.db_path)
+        self.assertEqual([(hit.user_id, hit.turn) for hit in hits], [("a", 0)])
+        self.assertIsNone(cursor)
+        self.assertEqual(search("dragon", source="cli", db_path=self.db_path), ([], None))
+
+    def test_analytics_are_updated_incrementally(self):
+        """Ensure depth, abandonment and choice counts follow the writes."""
+        storage.finish_story("b", db_path=self.db_path)
+        storage.save_user_progress("cli-user", None, ["Story: Cave\nDark. -> You leave."], db_path=self.db_path)
+        self.assertEqual(popular_choices(db_path=self.db_path), [("Run away", 2), ("Wake the dragon", 1)])
+        stats = depth_stats(db_path=self.db_path)
+        self.assertEqual((stats["stories"], stats["finished"], stats["average_depth"]), (3, 1, 1.0))
+        self.assertEqual(stats["abandoned_at"], {0: 1, 2: 1})
+        self.assertEqual(depth_stats("cli", db_path=self.db_path)["finished"], 1)
+
+    def test_rebuild_matches_incremental_index(self):
+        """Ensure rebuilding from the narratives gives the same index, including whole saved narratives."""
+        storage.save_narrative("legacy", "An old tale about a dragon.", db_path=self.db_path)
+        storage.save_narrative("legacy", "An old tale about a griffin.", db_path=self.db_path)
+        before = depth_stats(db_path=self.db_path), popular_choices(db_path=self.db_path)
+        storage.rebuild_story_index(db_path=self.db_path)
+        self.assertEqual((depth_stats(db_path=self.db_path), popular_choices(db_path=self.db_path)), before)
+        self.assertEqual([hit.user_id for hit in search("griffin", db_path=self.db_path)[0]], ["legacy"])
+        self.assertEqual(len(search("dragon", db_path=self.db_path)[0]), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import unittest
+
+import storage
+from db_test_case import DatabaseTestCase
+from story_graph import StoryGraph, StoryGraphLoader
+
+class TestStoryGraph(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.json_path = os.path.join(self.tmp.name, "story_data.json")
+
+    def test_lookup_and_validation(self):
+        """Ensure choices link nodes by position and broken links are reported."""
+        graph = StoryGraph(
+            [("1", "Start", "A door."), ("2", "Hall", "A hall."), ("3", "Loop", "Round."), ("4", "Loop", "Again.")],
+            [("1A", "1", "Open it", "It opens.", "2"), ("1B", "1", "Leave", "You leave.", None),
+             ("2A", "2", "Climb", "A ladder.", "9"), ("XA", "X", "Nothing", "Nothing.", None),
+             ("3A", "3", "Go on", "Onwards.", "4"), ("4A", "4", "Go back", "Back.", "3")],
+        )
+        self.assertEqual(graph.node("1").choices[0].next_node, graph.index["2"])
+        self.assertIsNone(graph.node("missing"))
+        self.assertEqual(graph.random_start(), "1")
+        self.assertEqual(graph.problems, [
+            "choice 2A leads to missing story 9",
+            "choice XA belongs to unknown story X",
+            "story 3 cannot be reached from any starting story",
+            "story 4 cannot be reached from any starting story",
+        ])
+
+    def test_loader_reloads_when_the_db_changes(self):
+        """Ensure the loader falls back to story_data.json and picks up DB writes."""
+        with open(self.json_path, "w", encoding="utf-8") as file:
+            json.dump([{"story_id": "1", "prompt": "From JSON.", "choices": []}], file)
+        loader = StoryGraphLoader(self.db_path, self.json_path, check_interval=0)
+        self.assertEqual(loader.get().node("1").prompt, "From JSON.")
+
+        storage.execute("INSERT INTO story_nodes (story_id, title, prompt) VALUES ('7', 'Seven', 'From the DB.')",
+                        db_path=self.db_path)
+        graph = loader.get()
+        self.assertEqual(graph.node("7").prompt, "From the DB.")
+        self.assertIs(loader.get(), graph)
+
+if __name__ == "__main__":
+    unittest.main()
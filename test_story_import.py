@@ -0,0 +1,70 @@
+import io
+import json
+import os
+import unittest
+
+import storage
+from db_test_case import DatabaseTestCase
+from story_import import DatasetError, import_stories, iter_json_array
+
+def story(story_id, prompt, next_story_id=None):
+    return {"story_id": story_id, "prompt": prompt, "choices": [
+        {"choice_id": f"{story_id}A", "text": "Go on", "outcome": "You go on.", "next_story_id": next_story_id}]}
+
+class TestStoryImport(DatabaseTestCase):
+    def write(self, name, stories):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            if name.endswith(".jsonl"):
+                file.writelines(json.dumps(s) + "\n" for s in stories)
+            else:
+                json.dump(stories, file)
+        return path
+
+    def test_json_array_is_read_in_chunks(self):
+        """Ensure stories split across read chunks are decoded intact."""
+        stories = [story(str(i), "A long prompt " * 20) for i in range(5)]
+        self.assertEqual(list(iter_json_array(io.StringIO(json.dumps(stories)), chunk_size=7)), stories)
+
+    def test_reimport_only_rewrites_changed_stories(self):
+        """Ensure imports are idempotent upserts keyed by story content."""
+        path = self.write("stories.jsonl", [story("1", "Start.", "2"), story("2", "End.")])
+        self.assertEqual(import_stories(path, db_path=self.db_path)["written"], 2)
+        self.assertEqual(import_stories(path, db_path=self.db_path)["unchanged"], 2)
+
+        path = self.write("stories.jsonl", [story("1", "Start.", "2"), story("2", "A new end.")])
+        counts = import_stories(path, db_path=self.db_path)
+        self.assertEqual((counts["written"], counts["unchanged"]), (1, 1))
+        self.assertEqual(storage.get_story_node("2", self.db_path)[2], "A new end.")
+        self.assertEqual(len(storage.get_node_choices("2", self.db_path)), 1)
+
+    def test_choice_ids_of_other_stories_are_rejected(self):
+        """Ensure an import cannot take over a choice_id stored for a story outside the dataset."""
+        first = self.write("first.json", [{"story_id": "1", "prompt": "Start.", "choices": [{"choice_id": "X", "text": "Go"}]}])
+        second = self.write("second.json", [{"story_id": "2", "prompt": "Other.", "choices": [{"choice_id": "X", "text": "Go"}]}])
+        import_stories(first, db_path=self.db_path)
+        with self.assertRaises(DatasetError) as raised:
+            import_stories(second, db_path=self.db_path)
+        self.assertEqual(raised.exception.errors, ["choice_id X in story 2 already belongs to story 1"])
+        self.assertEqual(len(storage.get_node_choices("1", self.db_path)), 1)
+        self.assertIsNone(storage.get_story_node("2", self.db_path))
+
+        # Moving a choice is fine when its old story is re-imported without it.
+        moved = self.write("moved.json", [{"story_id": "2", "prompt": "Other.", "choices": [{"choice_id": "X", "text": "Go"}]},
+                                          {"story_id": "1", "prompt": "Start."}])
+        import_stories(moved, batch_size=1, db_path=self.db_path)
+        self.assertEqual(storage.get_node_choices("1", self.db_path), [])
+        self.assertEqual(len(storage.get_node_choices("2", self.db_path)), 1)
+
+    def test_invalid_dataset_is_rolled_back(self):
+        """Ensure duplicate ids and dangling links fail the import without writing anything."""
+        path = self.write("stories.json", [story("1", "Start.", "9"), story("1", "Again.")])
+        with self.assertRaises(DatasetError) as raised:
+            import_stories(path, db_path=self.db_path)
+        self.assertIn("duplicate story_id 1", raised.exception.errors)
+        self.assertIn("next_story_id 9 does not match any story", raised.exception.errors)
+        self.assertIsNone(storage.get_story_node("1", self.db_path))
+        self.assertEqual(storage.story_graph_version(self.db_path), 0)
+
+if __name__ == "__main__":
+    unittest.main()
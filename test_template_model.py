@@ -0,0 +1,32 @@
+import os
+import unittest
+
+import storage
+from db_test_case import DatabaseTestCase
+from template_model import TemplateModel
+
+class TestTemplateModel(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        storage.replace_story_templates({
+            "fantasy": ["A dragon guards the mountain pass.", "The wizard opens the ancient door."],
+            "space": ["The starship drifts past a dying sun."],
+        }, db_path=self.db_path)
+        self.model = TemplateModel(self.db_path, os.path.join(self.tmp.name, "missing.json"))
+
+    def test_continuations_follow_the_narrative(self):
+        """Ensure continuations are distinct whole sentences, on the narrative's topic first, the same every time."""
+        texts = self.model.sample("You climb towards the dragon.", count=3)
+        self.assertEqual(texts[0], " A dragon guards the mountain pass.")
+        self.assertEqual(len(set(texts)), 3)
+        self.assertEqual(len(self.model.sample("You climb towards the dragon.", count=10)), 3)
+        self.assertEqual(self.model.sample("A starship.", count=2), self.model.sample("A starship.", count=2))
+        self.assertTrue(all(text.endswith(".") for text in self.model.sample("Unrelated words.", count=5)))
+
+    def test_empty_corpus(self):
+        """Ensure a model with nothing to learn from returns no continuations."""
+        storage.replace_story_templates({}, db_path=self.db_path)
+        self.assertEqual(TemplateModel(self.db_path, "missing.json").sample("Anything.", count=3), [])
+
+if __name__ == "__main__":
+    unittest.main()